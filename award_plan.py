@@ -0,0 +1,151 @@
+''' Award scheme rules compiled into index arrays for evaluating progress. '''
+
+import numpy as np
+
+
+class AwardPlan(object):
+    ''' An award scheme compiled once into an evaluation plan.
+
+        The scheme's parts must already be linked to their badges (see AwardScheme.link). '''
+
+    def __init__(self, scheme):
+        self.badges = {}
+        self.awards = []
+        for award in scheme.badges:
+            complete = None
+            if not award.badge is None:
+                complete = self._compile_badge(award.badge)
+            parts = [CompiledPart(part, self._compile_badge(part.badge)) for part in award.parts]
+            self.awards.append(CompiledAward(award, complete, parts))
+
+    def _compile_badge(self, badge):
+        try:
+            return self.badges[badge.badge_id]
+        except KeyError:
+            compiled = CompiledBadge(badge)
+            self.badges[badge.badge_id] = compiled
+            return compiled
+
+    def evaluate(self, member_ids=None):
+        ''' Evaluates the plan against the loaded progress of every member.
+            When no members are given, everyone with a progress record is included. '''
+        if member_ids is None:
+            member_ids = []
+            seen = set()
+            for badge in self.badges.values():
+                for item in badge.badge.progress:
+                    if not item.member_id in seen:
+                        seen.add(item.member_id)
+                        member_ids.append(item.member_id)
+        return PlanResult(self, member_ids)
+
+
+class CompiledAward(object):
+    ''' An award with its completion badge and compiled parts. '''
+
+    def __init__(self, award, complete, parts):
+        self.name = award.name
+        self.group = award.group
+        self.complete = complete
+        self.parts = parts
+
+
+class CompiledPart(object):
+    ''' An award part with the columns it reports. '''
+
+    def __init__(self, part, badge):
+        self.name = part.name
+        self.group = part.group
+        self.badge = badge
+        self.columns = badge.group_names if part.group else [part.name]
+
+
+class CompiledBadge(object):
+    ''' A badge's parts as index arrays.
+
+        Consecutive parts with the same (stripped) name form a group. '''
+
+    def __init__(self, badge):
+        self.badge = badge
+        self.part_ids = [part.part_id for part in badge.parts]
+        self.part_names = [part.name.strip().lower() for part in badge.parts]
+        self.group_names = []
+        group_index = []
+        last_name = None
+        for part in badge.parts:
+            name = part.name.strip()
+            if name != last_name:
+                last_name = name
+                self.group_names.append(name)
+            group_index.append(len(self.group_names) - 1)
+
+        self.group_index = np.array(group_index, dtype=np.intp)
+        self.groups = np.zeros((len(self.part_ids), len(self.group_names)))
+        self.groups[np.arange(len(self.part_ids)), self.group_index] = 1.0
+        self.denominators = np.maximum(self.groups.sum(axis=0), 1.0)
+        self.part_count = max(len(self.part_ids), 1)
+
+
+class BadgeResult(object):
+    ''' The evaluated progress of every member for one badge.
+
+        Rows follow the member order of the PlanResult. '''
+
+    def __init__(self, compiled, index):
+        count = len(index)
+        self.compiled = compiled
+        self.records = [None] * count
+        self.present = np.zeros(count, dtype=bool)
+        self.completed = np.zeros(count, dtype=bool)
+        self.done = np.zeros((count, len(compiled.part_ids)), dtype=bool)
+        for item in compiled.badge.progress:
+            try:
+                row = index[item.member_id]
+            except KeyError:
+                continue
+            self.records[row] = item
+            self.present[row] = True
+            self.completed[row] = item.completed
+            self.done[row] = [part_id in item.parts for part_id in compiled.part_ids]
+
+        done = self.done.astype(float)
+        self.fraction = done.sum(axis=1) / compiled.part_count
+        self.group_fraction = np.dot(done, compiled.groups) / compiled.denominators
+
+    def values(self, group):
+        ''' Gets the status values: completed badges count as 1.0 in every column. '''
+        fraction = self.group_fraction if group else self.fraction[:, np.newaxis]
+        return np.where(self.completed[:, np.newaxis], 1.0, fraction)
+
+
+class PlanResult(object):
+    ''' The result of evaluating an AwardPlan.
+
+        Each badge is evaluated the first time it is asked for, so a badge's
+        progress only needs to be loaded before its result is used. '''
+
+    def __init__(self, plan, member_ids):
+        self.plan = plan
+        self.member_ids = list(member_ids)
+        self.badges = {}
+        self._index = dict((member_id, row) for row, member_id in enumerate(self.member_ids))
+
+    def badge(self, compiled):
+        ''' Gets the result for a compiled badge. '''
+        try:
+            return self.badges[compiled.badge.badge_id]
+        except KeyError:
+            result = BadgeResult(compiled, self._index)
+            self.badges[compiled.badge.badge_id] = result
+            return result
+
+    def part_values(self, part):
+        ''' Gets the status values for an award part, one column per reported column. '''
+        return self.badge(part.badge).values(part.group)
+
+    def part_completion(self, part):
+        ''' Gets the mean percentage of the part's badge completed by members with a record. '''
+        result = self.badge(part.badge)
+        if not result.present.any():
+            return 0.0
+        return float(result.fraction[result.present].mean() * 100)
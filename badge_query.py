@@ -0,0 +1,168 @@
+''' Bitset indexes over badge progress for fast "who has/needs what" queries. '''
+
+
+class ProgressIndex(object):
+    ''' Indexes the loaded badge progress of one or more terms.
+
+        Every member gets a bit position; each badge keeps bitsets of the
+        members with a record, the members who completed it, the members who
+        completed each part and the members missing exactly n parts.
+
+        Every badge and badge part also gets a bit position; each member keeps
+        bitsets of the badges they have a record for, the badges they completed
+        and the parts they completed. Queries are set algebra over those bitsets. '''
+
+    def __init__(self):
+        self.members = []
+        self._member_index = {}
+        self._member_recorded = []
+        self._member_completed = []
+        self._member_parts = []
+        self._member_names = {}
+        self._badge_ids = {}
+        self._badges = {}
+        self._entries = []
+        self._part_count = 0
+
+    def add_term(self, term):
+        ''' Adds the badges of a term; their progress must already be loaded. '''
+        for badge in term.badges:
+            self._badge_ids[badge.name.lower()] = badge.badge_id
+            try:
+                entry = self._badges[badge.badge_id]
+            except KeyError:
+                entry = BadgeEntry(badge, 1 << len(self._entries), self._part_count)
+                self._badges[badge.badge_id] = entry
+                self._entries.append(entry)
+                self._part_count += len(entry.part_ids)
+            for item in badge.progress:
+                position = self._member_position(item)
+                self._member_recorded[position] |= entry.column
+                if item.completed:
+                    self._member_completed[position] |= entry.column
+                self._member_parts[position] |= entry.add(1 << position, item)
+
+    def _member_position(self, item):
+        try:
+            return self._member_index[item.member_id]
+        except KeyError:
+            position = len(self.members)
+            self._member_index[item.member_id] = position
+            self._member_names.setdefault(('%s %s' % (item.firstname, item.lastname)).lower(), position)
+            self.members.append(item)
+            self._member_recorded.append(0)
+            self._member_completed.append(0)
+            self._member_parts.append(0)
+            return position
+
+    def find_member(self, member):
+        ''' Finds the bit position of a member from their id or full name. '''
+        name = str(member).strip()
+        if name.lower() in self._member_names:
+            return self._member_names[name.lower()]
+        for member_id in (name, int(name) if name.isdigit() else None):
+            if member_id in self._member_index:
+                return self._member_index[member_id]
+        raise KeyError('Unknown member: %s' % (member, ))
+
+    def find_badge(self, badge):
+        ''' Finds the index entry for a badge, a badge identifier or a badge name. '''
+        badge_id = getattr(badge, 'badge_id', badge)
+        badge_id = self._badge_ids.get(str(badge_id).lower(), badge_id)
+        try:
+            return self._badges[badge_id]
+        except KeyError:
+            raise KeyError('Unknown badge: %s' % (badge, ))
+
+    def has(self, badge):
+        ''' Members who have completed the badge. '''
+        return self.find_badge(badge).completed
+
+    def has_not(self, badge):
+        ''' Members who have a record for the badge but have not completed it. '''
+        entry = self.find_badge(badge)
+        return entry.recorded & ~entry.completed
+
+    def has_part(self, badge, part_id):
+        ''' Members who have completed a part of the badge. '''
+        return self.find_badge(badge).parts[part_id]
+
+    def missing(self, badge, count):
+        ''' Members who have not completed the badge and need at most count more parts. '''
+        entry = self.find_badge(badge)
+        found = 0
+        for missing in range(min(count, len(entry.missing) - 1) + 1):
+            found |= entry.missing[missing]
+        return found & ~entry.completed
+
+    def completed_between(self, badge, low, high):
+        ''' Members who have completed between low and high (inclusive) parts of the badge. '''
+        entry = self.find_badge(badge)
+        total = len(entry.part_ids)
+        found = 0
+        for completed in range(max(low, 0), min(high, total) + 1):
+            found |= entry.missing[total - completed]
+        return found
+
+    def completed_by(self, member):
+        ''' The badges a member has completed. '''
+        return self.badges(self._member_completed[self.find_member(member)])
+
+    def close_for(self, member, count):
+        ''' The badges a member has started but not completed and needs at most count more
+            parts for, as (badge entry, parts needed) pairs. '''
+        position = self.find_member(member)
+        parts = self._member_parts[position]
+        close = []
+        for entry in self.badges(self._member_recorded[position] & ~self._member_completed[position]):
+            needed = bin(entry.part_mask & ~parts).count('1')
+            if needed <= count:
+                close.append((entry, needed))
+        return close
+
+    def badges(self, bits):
+        ''' Converts a bitset of badge columns into the matching badge entries. '''
+        return [self._entries[position] for position in _positions(bits)]
+
+    def people(self, bits):
+        ''' Converts a bitset into the matching progress records. '''
+        return [self.members[position] for position in _positions(bits)]
+
+
+class BadgeEntry(object):
+    ''' The bitsets for one badge. column is the badge's bit and the parts take the bits
+        from first_part on, so member bitsets can hold badges and parts. '''
+
+    def __init__(self, badge, column, first_part):
+        self.name = badge.name
+        self.column = column
+        self.part_ids = [part.part_id for part in badge.parts]
+        self.part_bits = dict((part_id, 1 << (first_part + n)) for n, part_id in enumerate(self.part_ids))
+        self.part_mask = sum(self.part_bits.values())
+        self.parts = dict((part_id, 0) for part_id in self.part_ids)
+        self.missing = [0] * (len(self.part_ids) + 1)
+        self.recorded = 0
+        self.completed = 0
+
+    def add(self, bit, item):
+        ''' Adds a member's progress; returns the bits of the parts they have completed. '''
+        self.recorded |= bit
+        if item.completed:
+            self.completed |= bit
+        done = 0
+        for part_id in self.part_ids:
+            if part_id in item.parts:
+                self.parts[part_id] |= bit
+                done |= self.part_bits[part_id]
+        self.missing[len(self.part_ids) - bin(done).count('1')] |= bit
+        return done
+
+
+def _positions(bits):
+    ''' The positions of the set bits, lowest first. '''
+    positions = []
+    while bits:
+        lowest = bits & -bits
+        positions.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return positions
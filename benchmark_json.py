@@ -0,0 +1,101 @@
+'''
+This script compares the JSON decoders Connection can use on recorded OSM responses.
+
+The responses are the raw bodies saved by a real run with "recordResponses" set to a
+folder in secret.json (see osm.ResponseRecorder), or come from a synthetic dataset (see
+osm_fixtures.py) when no folders are given.
+
+Usage: benchmark_json.py [recording folders...]
+'''
+
+import json
+import os
+import sys
+import timeit
+
+from osm import JSON_DECODERS, Manager, endpoint
+from osm_fixtures import Dataset, FixtureConnection
+
+# Each decoder runs for at least this long per endpoint.
+MIN_TIME = 0.2
+
+
+class JsonBenchmark(object):
+
+    def run(self):
+        if len(sys.argv) > 1:
+            print('Loading responses from %d folder(s)...' % (len(sys.argv) - 1, ))
+            payloads = self._load_recordings(sys.argv[1:])
+        else:
+            print('Generating responses...')
+            payloads = self._generate()
+
+        endpoints = {}
+        for name, content in payloads:
+            endpoints.setdefault(name, []).append(content)
+        print('-> %d responses from %d endpoints' % (len(payloads), len(endpoints)))
+        print('-> Decoders: %s' % (', '.join(name for name, _ in JSON_DECODERS), ))
+
+        names = [name for name, _ in JSON_DECODERS]
+        print('-> %-32s %9s %7s' % ('Endpoint', 'KB/resp', 'count') +
+              ''.join(' %10s' % (name + ' ms', ) for name in names) +
+              ''.join(' %8s' % ('x ' + name, ) for name in names if name != 'json'))
+        for name in sorted(endpoints):
+            contents = endpoints[name]
+            times = dict((decoder, self._time(decode, contents)) for decoder, decode in JSON_DECODERS)
+            size = sum(len(content) for content in contents) / 1024.0 / len(contents)
+            print('-> %-32s %9.1f %7d' % (name, size, len(contents)) +
+                  ''.join(' %10.3f' % (times[decoder] * 1000, ) for decoder in names) +
+                  ''.join(' %8.1f' % (times['json'] / times[decoder], ) for decoder in names if decoder != 'json'))
+        print('Done')
+
+    def _load_recordings(self, paths):
+        ''' Loads the saved bodies as they came from the server, named by the folder they are in. '''
+        payloads = []
+        for path in paths:
+            for folder, _, filenames in os.walk(path):
+                name = os.path.relpath(folder, path).replace(os.sep, '/')
+                for filename in sorted(filenames):
+                    with open(os.path.join(folder, filename), 'rb') as f:
+                        payloads.append((name, f.read()))
+        return payloads
+
+    def _generate(self):
+        conn = RecordingConnection(Dataset(sections=2, terms=2, members=60, badges=80))
+        mgr = Manager()
+        mgr.load(conn)
+        for section in mgr.sections:
+            for term in section.terms:
+                term.load_members(conn, True)
+                term.load_badges(conn)
+                term.load_progress(conn)
+                term.load_badges_by_person(conn)
+                term.load_programme(conn, True)
+        return conn.payloads
+
+    def _time(self, decode, contents):
+        ''' The mean time to decode each of the responses once. '''
+        timer = timeit.Timer(lambda: [decode(content) for content in contents])
+        number, total = timer.autorange() if hasattr(timer, 'autorange') else (1, timer.timeit(1))
+        while total < MIN_TIME:
+            number *= 2
+            total = timer.timeit(number)
+        return total / number / len(contents)
+
+
+class RecordingConnection(FixtureConnection):
+    ''' A fixture connection that keeps the raw body of every response. '''
+
+    def __init__(self, dataset):
+        super(RecordingConnection, self).__init__(dataset)
+        self.payloads = []
+
+    def _send(self, url, data):
+        resp = super(RecordingConnection, self)._send(url, data)
+        self.payloads.append((endpoint(url), json.dumps(resp).encode('utf-8')))
+        return resp
+
+
+if __name__ == "__main__":
+    mgr = JsonBenchmark()
+    mgr.run()
@@ -0,0 +1,84 @@
+''' Skips rebuilding reports whose inputs have not changed since they were last built. '''
+
+import hashlib
+import json
+import os
+import threading
+
+from datetime import date, datetime, time
+
+from osm import write_json
+
+# Changing this invalidates every cached report.
+CACHE_VERSION = 1
+
+# Attributes that point back to a parent object, so they are left out of the inputs.
+PARENTS = ('term', 'section', 'badge')
+
+# The folder holding the scripts and the modules they share.
+CODE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+_update_lock = threading.Lock()
+
+
+class BuildCache(object):
+    ''' The input hashes of the reports that have been built, keyed by output file. '''
+
+    def __init__(self, path='build-cache.json'):
+        self._path = path
+        self._hashes = self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def key(self, data, files=()):
+        ''' Hashes the normalised data together with the contents of the files the report
+            depends on (the generator script, templates and settings). '''
+        digest = hashlib.sha256(('%d\n' % (CACHE_VERSION, )).encode('utf-8'))
+        for path in files:
+            digest.update(('%s\n' % (os.path.basename(path), )).encode('utf-8'))
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except IOError:
+                digest.update(b'missing')
+        digest.update(json.dumps(normalise(data), sort_keys=True, separators=(',', ':')).encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_current(self, output, key):
+        ''' Checks whether the output exists and was built from the same inputs. '''
+        return self._hashes.get(output) == key and os.path.exists(output)
+
+    def update(self, output, key):
+        ''' Records the inputs an output was built from, keeping the entries other
+            generators have recorded since this cache was loaded. '''
+        with _update_lock:
+            self._hashes = self._load()
+            self._hashes[output] = key
+            write_json(self._path, self._hashes)
+
+
+def code_files(script, *modules):
+    ''' The paths of a generator script, osm.py and the other shared modules it uses. They are
+        found next to this module, so the key is the same whichever folder the script runs in. '''
+    return [os.path.abspath(script)] + [os.path.join(CODE_FOLDER, name) for name in ('osm.py', ) + modules]
+
+
+def normalise(value):
+    ''' Converts loaded OSM objects into plain data: public attributes only, without parent links. '''
+    if isinstance(value, dict):
+        return dict((str(key), normalise(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted(normalise(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [normalise(item) for item in value]
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if hasattr(value, '__dict__'):
+        return dict((name, normalise(item)) for name, item in vars(value).items()
+                    if not name.startswith('_') and not name in PARENTS)
+    return value
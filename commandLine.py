@@ -3,13 +3,16 @@
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
 import xlsxwriter
+from badge_query import ProgressIndex
 from docx import Document
 from docx.enum.section import WD_ORIENT
 from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Cm, Pt
+from docx_builder import Picture, TableBuilder
 from osm import Connection, Manager
 
 
@@ -21,6 +24,9 @@ class ProgrammeManager(object):
         self._exit = False
         self._section = None
         self._term = None
+        self._executor = ThreadPoolExecutor(max_workers=3)
+        self._prefetch = {}
+        self._index = None
 
         self._commands = {
             'q': self._exit_manager,
@@ -34,6 +40,7 @@ class ProgrammeManager(object):
             'programme': self._list_programme,
             'badges': self._list_badges,
             'badge': self._badge_actions,
+            'query': self._query_progress,
         }
 
         self._badge_commands = {
@@ -42,6 +49,13 @@ class ProgrammeManager(object):
             'export': self._export_badge_progress,
         }
 
+        self._query_commands = {
+            'close': self._query_close,
+            'has': self._query_has,
+            'between': self._query_between,
+            'member': self._query_member,
+        }
+
 
     def _connect(self):
         self._conn = Connection('secret.json')
@@ -108,6 +122,33 @@ class ProgrammeManager(object):
 
     def _exit_manager(self, args):
         self._exit = True
+        self._executor.shutdown(wait=False)
+
+    def _select_term(self, term):
+        self._term = term
+        print 'Term set to %s' % (str(term), )
+        self._start_prefetch()
+
+    def _start_prefetch(self):
+        term = self._term
+        self._prefetch = {
+            'badges': self._executor.submit(term.load_badges, self._conn),
+            'members': self._executor.submit(term.load_members, self._conn),
+            'programme': self._executor.submit(term.load_programme, self._conn, True),
+        }
+
+    def _wait_for(self, name):
+        try:
+            task = self._prefetch[name]
+        except KeyError:
+            return
+
+        if not task.done():
+            print 'Waiting for %s...' % (name, )
+        try:
+            task.result()
+        except Exception as ex:
+            print '...background load of %s failed: %s' % (name, str(ex))
 
     
     def _list_sections(self, args):
@@ -156,14 +197,12 @@ class ProgrammeManager(object):
                 print 'Currently not in a term'
                 return
             else:
-                self._term = term
-                print 'Term set to %s' % (str(term), )
+                self._select_term(term)
                 return
 
         for term in self._section.terms:
             if term.name == term_name:
-                self._term = term
-                print 'Term set to %s' % (str(term), )
+                self._select_term(term)
                 return
             
         print 'Unknown term: %s' % (term_name, )
@@ -173,6 +212,7 @@ class ProgrammeManager(object):
             print 'Term must be set first'
             return
 
+        self._wait_for('members')
         if not self._term.members_loaded:
             print 'Loading members...'
             self._term.load_members(self._conn)
@@ -184,6 +224,7 @@ class ProgrammeManager(object):
             print 'Term must be set first'
             return
 
+        self._wait_for('programme')
         if not self._term.programme_loaded > 0:
             print 'Loading programme...'
             self._term.load_programme(self._conn)
@@ -243,6 +284,7 @@ class ProgrammeManager(object):
             else:
                 print 'Unknown command'
         else:
+            self._wait_for('badges')
             if not self._term.badges_loaded:
                 print 'Loading badges...'
                 self._term.load_badges(self._conn)
@@ -255,6 +297,7 @@ class ProgrammeManager(object):
             print 'Missing filename'
             return
 
+        self._wait_for('badges')
         if not self._term.badges_loaded:
             print 'Loading badges...'
             self._term.load_badges(self._conn)
@@ -309,34 +352,23 @@ class ProgrammeManager(object):
 
         section.header.paragraphs[0].text = 'Badge Report'
         section.footer.paragraphs[0].text = 'Generated ' + now.strftime('%d %B %Y')
-        table = document.add_table(rows = 1, cols = 2, style='Table Grid')
-        table.columns[0].width = Cm(5)
-        table.columns[1].width = Cm(21)
-        cells = table.rows[0].cells
-        cells[0].text = 'Person'
-        cells[1].text = 'Badges'
-        cells[0].width = Cm(5)
-        cells[1].width = Cm(21)
-        clearFormatting(cells[0].paragraphs[0], headingStyle)
-        clearFormatting(cells[1].paragraphs[0], headingStyle)
+        table = document.add_table(rows = 0, cols = 2, style='Table Grid')
+        builder = TableBuilder(document, table, [Cm(5), Cm(21)], spacing=Pt(0))
+        builder.add_row([['Person'], ['Badges']], style=headingStyle)
         for person in report:
-            cells = table.add_row().cells
             name = '%s %s' % (person.first_name, person.last_name)
             print '...adding row for %s...' % (name, )
-            cells[0].text = name
-            clearFormatting(cells[0].paragraphs[0])
-            para = cells[1].paragraphs[0]
-            clearFormatting(para)
-            cells[0].width = Cm(5)
-            cells[1].width = Cm(21)
+            pictures = []
             for badge in person.badges:
                 badge_path = os.path.join('badge_images', os.path.basename(badge.picture))
                 if not os.path.exists(badge_path):
                     print '...retrieving badge image for %s...' % (badge.name,)
                     self._conn.download_binary(badge.picture, badge_path)
                 if badge.completed:
-                    para.add_run().add_picture(badge_path, width = Cm(2))
-                    para.add_run(' ')
+                    pictures.append(Picture(badge_path, Cm(2)))
+                    pictures.append(' ')
+            builder.add_row([[name], pictures])
+        builder.build()
 
         print '...saving...'
         document.save(filename)
@@ -356,10 +388,15 @@ class ProgrammeManager(object):
             print 'Term must be set first'
             return
 
+        self._wait_for('badges')
         if not self._term.badges_loaded:
             print 'Loading badges...'
             self._term.load_badges(self._conn)
 
+        if args[0] == 'export' and args[1] == 'all':
+            self._export_all_badge_progress(args[2:])
+            return
+
         try:
             cmd = self._badge_commands[args[0]]
         except KeyError:
@@ -369,7 +406,7 @@ class ProgrammeManager(object):
         try:
             badge_number = int(args[1])            
             badge = self._term.badges[badge_number - 1]
-        except IndexError:
+        except (IndexError, ValueError):
             print 'Unknown badge %s' % (args[1], )
             return
 
@@ -394,35 +431,130 @@ class ProgrammeManager(object):
             return
 
         filename = ensureExtension(args[-1], '.xlsx')
-        badges = [self._term.badges[int(n) - 1] for n in args[:-1]]
-        workbook = xlsxwriter.Workbook(filename)
+        badges = [badge] + [self._term.badges[int(n) - 1] for n in args[:-1]]
+        self._write_badge_progress(filename, badges)
 
+    def _export_all_badge_progress(self, args):
+        if len(args) < 1:
+            print 'Missing filename'
+            return
+
+        filename = ensureExtension(args[-1], '.xlsx')
+        self._write_badge_progress(filename, self._term.badges)
+
+    def _write_badge_progress(self, filename, badges):
         print 'Exporting badge progress...'
-        print '...%s...' % (badge.name,)
-        if not badge.progress_loaded:
-            print '...loading badge progress...'
-            badge.load_progress(self._conn)
+        print '...loading badge progress...'
+        self._term.load_progress(self._conn, badges)
 
-        badge.export_progress(workbook=workbook)
-        for other in badges:
-            print '...%s...' % (other.name,)
-            if not other.progress_loaded:
-                print '...loading badge progress...'
-                other.load_progress(self._conn)
-            other.export_progress(workbook=workbook)
+        workbook = xlsxwriter.Workbook(filename)
+        for badge in badges:
+            print '...%s...' % (badge.name,)
+            badge.export_progress(workbook=workbook)
         workbook.close()
         print '...done'
 
 
+    def _query_progress(self, args):
+        if len(args) < 1:
+            print 'Missing query'
+            return
+
+        if args[0] == 'load':
+            self._load_index(args[1:])
+            return
+
+        try:
+            cmd = self._query_commands[args[0]]
+        except KeyError:
+            print 'Unknown query %s' % (args[0], )
+            return
+
+        if self._index is None:
+            self._load_index([])
+            if self._index is None:
+                return
+
+        try:
+            people = cmd(args[1:])
+        except (KeyError, IndexError, ValueError) as ex:
+            print 'Invalid query: %s' % (str(ex), )
+            return
+
+        if people is None:
+            return
+        for person in self._index.people(people):
+            print str(person)
+        print '%d member(s)' % (bin(people).count('1'), )
+
+    def _load_index(self, args):
+        if len(args) > 0 and args[0] == 'all':
+            terms = [section.current_term() for section in self._mgr.sections]
+            terms = [term for term in terms if not term is None]
+        elif self._term is None:
+            print 'Term must be set first'
+            return
+        else:
+            terms = [self._term]
+
+        print 'Indexing badge progress...'
+        index = ProgressIndex()
+        for term in terms:
+            if term is self._term:
+                self._wait_for('badges')
+            if not term.badges_loaded:
+                print '...loading badges for %s...' % (term.section.name, )
+                term.load_badges(self._conn)
+            print '...loading badge progress for %s...' % (term.section.name, )
+            term.load_progress(self._conn)
+            index.add_term(term)
+        self._index = index
+        print '...indexed %d member(s)' % (len(index.members), )
+
+    def _find_query_badge(self, name):
+        try:
+            return self._term.badges[int(name) - 1]
+        except (AttributeError, ValueError, IndexError):
+            return name
+
+    def _query_close(self, args):
+        if len(args) < 2:
+            print 'Usage: query close <badge> <parts>'
+            return None
+        return self._index.missing(self._find_query_badge(args[0]), int(args[1]))
+
+    def _query_has(self, args):
+        if len(args) < 1:
+            print 'Usage: query has <badge> [not <badge>]'
+            return None
+        people = self._index.has(self._find_query_badge(args[0]))
+        if len(args) > 2 and args[1] == 'not':
+            people &= ~self._index.has(self._find_query_badge(args[2]))
+        return people
+
+    def _query_between(self, args):
+        if len(args) < 3:
+            print 'Usage: query between <badge> <low> <high>'
+            return None
+        return self._index.completed_between(self._find_query_badge(args[0]), int(args[1]), int(args[2]))
+
+    def _query_member(self, args):
+        if len(args) < 1:
+            print 'Usage: query member <name or id> [parts]'
+            return None
+        parts = int(args[-1]) if len(args) > 1 and args[-1].isdigit() else None
+        name = ' '.join(args[:-1] if not parts is None else args)
+        completed = self._index.completed_by(name)
+        print 'Completed: %s' % (', '.join(entry.name for entry in completed) or 'none', )
+        if not parts is None:
+            for entry, needed in self._index.close_for(name, parts):
+                print '%s: %d part(s) to go' % (entry.name, needed)
+        return None
+
+
 def ensureExtension(filename, extension):
     return filename if filename.lower().endswith(extension) else filename + extension
 
-def clearFormatting(paragraph, style=None):
-    paragraph.paragraph_format.space_before = Pt(0)
-    paragraph.paragraph_format.space_after = Pt(0)
-    if style is not None:
-        paragraph.style = style
-
 if __name__ == "__main__":
     mgr = ProgrammeManager()
     mgr.run()
@@ -0,0 +1,140 @@
+''' Helpers for building large docx tables directly as OOXML. '''
+
+from xml.sax.saxutils import escape
+
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+# EMUs per twip (1/20th of a point).
+EMU_PER_TWIP = 635
+
+PICTURE_XML = (
+    '<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+    '<wp:extent cx="%(cx)d" cy="%(cy)d"/>'
+    '<wp:docPr id="%(id)d" name="Picture %(id)d"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="%(name)s"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="%(rId)s"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="%(cx)d" cy="%(cy)d"/></a:xfrm>'
+    '<a:prstGeom prst="rect"/></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+    '</wp:inline></w:drawing></w:r>')
+
+
+class Picture(object):
+    ''' An inline picture to add to a cell. '''
+
+    def __init__(self, path, width):
+        self.path = path
+        self.width = width
+
+
+class TableBuilder(object):
+    ''' Builds the rows of a table as OOXML and appends them in one go.
+
+        Rows are marked as cantSplit, and widths and paragraph spacing are
+        set when each row is generated, so no per-cell python-docx calls are
+        needed. '''
+
+    def __init__(self, document, table, widths, spacing=None):
+        self._document = document
+        self._table = table
+        self._widths = widths
+        self._spacing = ''
+        if spacing is not None:
+            self._spacing = '<w:spacing w:before="%d" w:after="%d"/>' % (
+                _twips(spacing), _twips(spacing))
+        self._rows = []
+        self._images = {}
+        self._next_id = None
+        for column, width in zip(table.columns, widths):
+            column.width = width
+
+    def add_row(self, cells, style=None, header=False, widths=None):
+        ''' Adds a row. Each cell is a list of text and Picture items. '''
+        if widths is None:
+            widths = self._widths
+        row_props = '<w:cantSplit/>'
+        if header:
+            row_props += '<w:tblHeader w:val="true"/>'
+        para_props = self._spacing
+        if style is not None:
+            para_props = '<w:pStyle w:val="%s"/>%s' % (style.style_id, para_props)
+
+        xml = ['<w:tr><w:trPr>', row_props, '</w:trPr>']
+        for width, items in zip(widths, cells):
+            xml.append('<w:tc><w:tcPr><w:tcW w:w="%d" w:type="dxa"/></w:tcPr>' % (_twips(width), ))
+            xml.append('<w:p><w:pPr>%s</w:pPr>' % (para_props, ))
+            for item in items:
+                if isinstance(item, Picture):
+                    xml.append(self._picture_xml(item))
+                else:
+                    xml.append('<w:r><w:t xml:space="preserve">%s</w:t></w:r>' % (escape(item), ))
+            xml.append('</w:p></w:tc>')
+        xml.append('</w:tr>')
+        self._rows.append(''.join(xml))
+
+    def build(self):
+        ''' Parses all the pending rows at once and appends them to the table. '''
+        if len(self._rows) == 0:
+            return
+        rows = parse_xml('<w:tbl %s>%s</w:tbl>' % (
+            nsdecls('w', 'wp', 'a', 'pic', 'r'), ''.join(self._rows)))
+        tbl = self._table._tbl
+        for tr in list(rows):
+            tbl.append(tr)
+        self._rows = []
+
+    def _picture_xml(self, picture):
+        try:
+            rId, image = self._images[picture.path]
+        except KeyError:
+            rId, image = self._document.part.get_or_add_image(picture.path)
+            self._images[picture.path] = (rId, image)
+
+        if self._next_id is None:
+            self._next_id = self._document.part.next_id
+        shape_id = self._next_id
+        self._next_id += 1
+
+        cx, cy = image.scaled_dimensions(picture.width, None)
+        return PICTURE_XML % {
+            'cx': cx,
+            'cy': cy,
+            'id': shape_id,
+            'name': escape(image.filename, {'"': '&quot;'}),
+            'rId': rId
+        }
+
+
+class ParagraphWriter(object):
+    ''' Collects paragraphs as OOXML and appends them to the document body in bulk. '''
+
+    def __init__(self, document):
+        self._body = document.element.body
+        self._paragraphs = []
+
+    def add_paragraph(self, text, style=None):
+        ''' Queues a paragraph of text, optionally with a paragraph style. '''
+        props = ''
+        if style is not None:
+            props = '<w:pPr><w:pStyle w:val="%s"/></w:pPr>' % (style.style_id, )
+        self._paragraphs.append('<w:p>%s<w:r><w:t xml:space="preserve">%s</w:t></w:r></w:p>' % (
+            props, escape(text)))
+
+    def flush(self):
+        ''' Parses the queued paragraphs at once and adds them to the end of the body. '''
+        if len(self._paragraphs) == 0:
+            return
+        paragraphs = parse_xml('<w:body %s>%s</w:body>' % (nsdecls('w'), ''.join(self._paragraphs)))
+        sect_pr = self._body.sectPr
+        for p in list(paragraphs):
+            if sect_pr is None:
+                self._body.append(p)
+            else:
+                sect_pr.addprevious(p)
+        self._paragraphs = []
+
+
+def _twips(length):
+    return int(length) // EMU_PER_TWIP
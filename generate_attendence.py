@@ -7,6 +7,7 @@ import sys
 
 from datetime import date
 import xlsxwriter
+from memory_profile import MemoryProfile
 from osm import Connection, Manager
 
 
@@ -27,9 +28,11 @@ class ReportGenerator(object):
         self._mgr.load(self._conn)
 
     def run(self):
+        memory = MemoryProfile()
         print('Connecting to OSM...')
         self._connect()
         self._initialise()
+        memory.checkpoint('loading sections')
 
         if len(sys.argv) < 3:
             print('ERROR: term and section have not been set! ')
@@ -41,15 +44,19 @@ class ReportGenerator(object):
 
         print('Retrieving term programme...')
         report = self._term.load_programme(self._conn, include_attendance=True)
+        memory.checkpoint('loading attendance')
 
         print('Generating report...')
         filename = ensureExtension(sys.argv[2]+'-Attendence', '.xlsx')
         workbook = xlsxwriter.Workbook(filename)
         self._generate_report(report, workbook)
+        memory.checkpoint('rendering')
 
         print('Saving to %s...' % (filename, ))
         workbook.close()
+        memory.checkpoint('saving')
 
+        memory.report()
         print('Done')
 
     def _set_term(self, args):
@@ -4,10 +4,16 @@ This script generates an audit report of which items each member has completed f
 
 import sys
 
+import numpy as np
+
+from build_cache import BuildCache, code_files
 from datetime import date
 from docx import Document
 from docx.shared import Cm
-from osm import AwardScheme, Connection, Manager
+from docx_builder import ParagraphWriter
+from award_plan import AwardPlan
+from memory_profile import MemoryProfile
+from osm import AwardScheme, Connection, FetchPlan, Journal, Manager
 
 class ReportGenerator(object):
 
@@ -21,19 +27,27 @@ class ReportGenerator(object):
         self._conn = Connection('secret.json')
         self._conn.connect()
 
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
     def _initialise(self):
         self._mgr = Manager()
         self._mgr.load(self._conn)
 
     def run(self):
-        print('Connecting to OSM...')
-        self._connect()
-        self._initialise()
-
         if len(sys.argv) < 3:
             print('ERROR: term and section have not been set! ')
             return
 
+        memory = MemoryProfile()
+        print('Connecting to OSM...')
+        self._connect()
+        self._start_journal(ensureExtension(sys.argv[2]+'-Badge Audit', '.journal'))
+        self._initialise()
+        memory.checkpoint('loading sections')
+
         self._set_term(sys.argv[1:3])
         if self._term is None:
             return
@@ -46,16 +60,35 @@ class ReportGenerator(object):
         for badge in self._term.badges:
             badge_map[badge.badge_id] = badge
         print('-> Loaded badges')
+        plan = FetchPlan(scheme, badge_map)
+        plan.fetch(self._term, self._conn)
+        print('-> Loaded progress for %d badges' % (len(plan.badges), ))
+        memory.checkpoint('loading progress')
 
-        print('Generating report...')
         filename = ensureExtension(sys.argv[2]+'-Badge Audit', '.docx')
+        cache = BuildCache()
+        key = cache.key(plan.badges, code_files(__file__, 'award_plan.py', 'docx_builder.py') +
+                        [self._section.name + '-award.json'])
+        if cache.is_current(filename, key):
+            print('-> %s is up to date' % (filename, ))
+            self._conn.journal.finish()
+            memory.report()
+            print('Done')
+            return
+
+        print('Generating report...')
         document = Document()
         self._generate_header_footer(document)
-        self._generate_report(scheme, document, badge_map)
+        self._generate_report(AwardPlan(scheme), document)
+        memory.checkpoint('rendering')
 
         print('Saving to %s...' % (filename, ))
         document.save(filename)
+        cache.update(filename, key)
+        memory.checkpoint('saving')
 
+        self._conn.journal.finish()
+        memory.report()
         print('Done')
 
     def _set_term(self, args):
@@ -96,46 +129,56 @@ class ReportGenerator(object):
         section.header.paragraphs[0].text = 'Badge Progress Report'
         section.footer.paragraphs[0].text = 'Generated ' + now.strftime('%d %B %Y')
 
-    def _generate_report(self, scheme, document, badge_map):
-        members = {}
-        for badge in scheme.badges:
+    def _generate_report(self, plan, document):
+        result = plan.evaluate()
+        names = [''] * len(result.member_ids)
+        members, parts, activities = [], [], []
+        for badge in plan.awards:
             for part in badge.parts:
-                part.badge = badge_map[part.id]
-                part.badge.load_progress(self._conn)
-                part_map = dict((p.part_id, p.name.strip().lower()) for p in part.badge.parts)
-                print('-> Loaded "%s"...' % (part.badge.name,))
-
-                for person in part.badge.progress:
-                    name = person.firstname + ' ' + person.lastname
-                    for p_id, activity in person.parts.items():
-                        p_name = part_map[p_id]
-
-                        try:
-                            items = members[name]
-                        except KeyError:
-                            items = {}
-                            members[name] = items
-
-                        try:
-                            activities = items[p_name]                            
-                        except KeyError:
-                            activities = []
-                            items[p_name] = activities
-                        activities.append(activity + ' [' + badge.name + ']')
+                compiled = part.badge
+                part_result = result.badge(compiled)
+                rows, columns = part_result.done.nonzero()
+                for row, column in zip(rows.tolist(), columns.tolist()):
+                    person = part_result.records[row]
+                    names[row] = person.firstname + ' ' + person.lastname
+                    members.append(row)
+                    parts.append(compiled.part_names[column])
+                    activities.append(person.parts[compiled.part_ids[column]] + ' [' + badge.name + ']')
             
             print('-> Processed "%s"...' % (badge.name,))
         
         print('-> Generating final audit')
-        for member in sorted(members.keys()):
-            paragraph = document.add_paragraph(member.title())
-            paragraph.style = document.styles['Heading 1']
-            items = members[member]
-            for item in sorted(items.keys()):
-                paragraph = document.add_paragraph(item)
-                paragraph.style = document.styles['Heading 2']
-                for activity in sorted(items[item]):
-                    document.add_paragraph(activity)
-            print('-> Completed "%s"...' % (member,))
+        if len(members) == 0:
+            return
+
+        # Index every activity by member and part, sorted by member name, member id, part and activity
+        member_rank = np.empty(len(names), dtype=np.intp)
+        member_rank[sorted(range(len(names)), key=lambda row: (names[row], str(result.member_ids[row])))] = np.arange(len(names))
+        members = np.array(members)
+        part_names, part_codes = np.unique(parts, return_inverse=True)
+        activities = np.array(activities)
+        order = np.lexsort((activities, part_codes, member_rank[members]))
+
+        member_style = document.styles['Heading 1']
+        part_style = document.styles['Heading 2']
+        writer = ParagraphWriter(document)
+        last_member, last_part = None, None
+        for index in order.tolist():
+            member = members[index]
+            if member != last_member:
+                if not last_member is None:
+                    writer.flush()
+                    print('-> Completed "%s"...' % (names[last_member],))
+                writer.add_paragraph(names[member].title(), member_style)
+                last_member, last_part = member, None
+            part = part_codes[index]
+            if part != last_part:
+                writer.add_paragraph(part_names[part], part_style)
+                last_part = part
+            writer.add_paragraph(activities[index])
+        writer.flush()
+        print('-> Completed "%s"...' % (names[last_member],))
+
 
 def ensureExtension(filename, extension):
     return filename if filename.lower().endswith(extension) else filename + extension
@@ -2,15 +2,31 @@
 This script generates an overall progress report of where the division is at for the award scheme badges.
 '''
 
+import hashlib
+import json
 import os
 import sys
 
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from build_cache import BuildCache, code_files
 from datetime import date
 from docx import Document
 from docx.shared import Cm
-from osm import AwardScheme, Connection, Manager
+from award_plan import AwardPlan
+from memory_profile import MemoryProfile
+from osm import AwardScheme, Connection, FetchPlan, Journal, Manager
+from pipeline import prefetch
+from progress_history import ProgressHistory
 
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Resolution for the rendered charts; they are embedded 16cm wide.
+CHART_DPI = 200
+
+# A horizontal bar chart; each bar is row_height inches high.
+Chart = namedtuple('Chart', ['labels', 'counts', 'xlabel', 'xmax', 'row_height'])
 
 
 class ReportGenerator(object):
@@ -25,6 +41,11 @@ class ReportGenerator(object):
         self._conn = Connection('secret.json')
         self._conn.connect()
 
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
     def _initialise(self):
         self._mgr = Manager()
         self._mgr.load(self._conn)
@@ -37,9 +58,12 @@ class ReportGenerator(object):
             print('ERROR: term and section have not been set! ')
             return
 
+        memory = MemoryProfile()
         print('Connecting to OSM...')
         self._connect()
+        self._start_journal(ensureExtension(sys.argv[2]+'-Badge Progress', '.journal'))
         self._initialise()
+        memory.checkpoint('loading sections')
 
         self._set_term(sys.argv[1:3])
         if self._term is None:
@@ -53,16 +77,40 @@ class ReportGenerator(object):
         for badge in self._term.badges:
             badge_map[badge.badge_id] = badge
         print('-> Loaded badges')
+        plan = FetchPlan(scheme, badge_map)
+        plan.fetch(self._term, self._conn)
+        print('-> Loaded progress for %d badges' % (len(plan.badges), ))
+        memory.checkpoint('loading progress')
+        # One history per term, so another term's progress is not mistaken for changes.
+        history_path = '%s-%s-history.txt' % (self._section.name, self._term.term_id)
+        history = ProgressHistory(history_path)
+        changes = history.snapshot(plan.badges.values())
+        print('-> Recorded %d changes in the progress history' % (changes, ))
 
-        print('Generating report...')
         filename = ensureExtension(sys.argv[2]+'-Badge Progress', '.docx')
+        cache = BuildCache()
+        key = cache.key(plan.badges, code_files(__file__, 'award_plan.py', 'pipeline.py', 'progress_history.py') +
+                        [self._section.name + '-award.json', history_path])
+        if cache.is_current(filename, key):
+            print('-> %s is up to date' % (filename, ))
+            self._conn.journal.finish()
+            memory.report()
+            print('Done')
+            return
+
+        print('Generating report...')
         document = Document()
         self._generate_header_footer(document)
-        self._generate_report(scheme, document, badge_map)
+        self._generate_report(AwardPlan(scheme), document, history)
+        memory.checkpoint('rendering')
 
         print('Saving to %s...' % (filename, ))
         document.save(filename)
+        cache.update(filename, key)
+        memory.checkpoint('saving')
 
+        self._conn.journal.finish()
+        memory.report()
         print('Done')
 
     def _set_term(self, args):
@@ -103,32 +151,73 @@ class ReportGenerator(object):
         section.header.paragraphs[0].text = 'Badge Progress Report'
         section.footer.paragraphs[0].text = 'Generated ' + now.strftime('%d %B %Y')
 
-    def _generate_report(self, scheme, document, badge_map):
-        for badge in scheme.badges:
-            paragraph = document.add_paragraph(badge.name)
-            paragraph.style = document.styles['Heading 1']
-            counts, labels = [], []
-            for part in badge.parts:
-                progress = 0
-                part.badge = badge_map[part.id]
-                part.badge.load_progress(self._conn)
-                print('-> Loaded "%s"...' % (part.badge.name,))
-                for person in part.badge.progress:
-                    progress += len(person.parts)
-
-                mean = progress * 100 / len(part.badge.progress)
-                completion = mean / len(part.badge.parts)
-                labels.append(part.name)
-                counts.append(completion)
-            
-            fig, ax = plt.subplots(1, 1, figsize=(5, len(badge.parts)))
-            ax.set_xlim(0, 100)
-            ax.set_xlabel('Percentage completed')
-            ax.barh(labels, counts)
-            badge_path = os.path.join('temp_images', badge.name + '.png')
-            fig.savefig(badge_path, bbox_inches='tight', dpi=300)
-            document.add_picture(badge_path, width=Cm(16))
-            print('-> Generated "%s"...' % (badge.name,))
+    def _generate_report(self, plan, document, history):
+        result = plan.evaluate()
+        print('-> Rendering charts...')
+        # Each section keeps its own charts, so pruning one section's old charts leaves the others cached.
+        folder = os.path.join('temp_images', self._section.name + '-charts')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        used = set()
+        with ProcessPoolExecutor() as executor:
+            # Keep every worker busy with the next charts while the finished ones are added.
+            charts = prefetch(self._charts(plan, result, history),
+                              lambda item: executor.submit(render_chart, item[1], folder), os.cpu_count() or 1)
+            for (title, _), rendering in charts:
+                chart_path = rendering.result()
+                used.add(os.path.basename(chart_path))
+                paragraph = document.add_paragraph(title)
+                paragraph.style = document.styles['Heading 1']
+                document.add_picture(chart_path, width=Cm(16))
+                print('-> Generated "%s"...' % (title,))
+        pruned = prune_charts(folder, used)
+        if pruned > 0:
+            print('-> Removed %d old chart(s)' % (pruned, ))
+
+    def _charts(self, plan, result, history):
+        ''' Works out the (title, chart) of each award and then of the weekly progress, as they are needed. '''
+        for award in plan.awards:
+            labels = [part.name for part in award.parts]
+            counts = [result.part_completion(part) for part in award.parts]
+            yield award.name, Chart(labels, counts, 'Percentage completed', 100, 1)
+
+        weeks = history.parts_completed_per_week(set(plan.badges.keys()))
+        if len(weeks) > 0:
+            labels = [week.strftime('%d %b') for week, _ in weeks]
+            counts = [count for _, count in weeks]
+            yield 'Parts Completed per Week', Chart(labels, counts, 'Parts completed', None, 0.3)
+
+
+def render_chart(chart, folder):
+    ''' Renders a chart off-screen, reusing the cached image if the data has not changed. '''
+    key = json.dumps(list(chart) + [CHART_DPI])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    chart_path = os.path.join(folder, digest + '.png')
+    if os.path.exists(chart_path):
+        return chart_path
+
+    fig = Figure(figsize=(5, max(len(chart.labels) * chart.row_height, 1)))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    if not chart.xmax is None:
+        ax.set_xlim(0, chart.xmax)
+    ax.set_xlabel(chart.xlabel)
+    ax.barh(chart.labels, chart.counts)
+    temp_path = chart_path + '.%d.tmp' % (os.getpid(), )
+    fig.savefig(temp_path, bbox_inches='tight', dpi=CHART_DPI, format='png')
+    fig.clear()
+    os.replace(temp_path, chart_path)
+    return chart_path
+
+
+def prune_charts(folder, used):
+    ''' Removes the cached charts that were not used by this run; returns how many were removed. '''
+    pruned = 0
+    for filename in os.listdir(folder):
+        if filename.endswith('.png') and not filename in used:
+            os.remove(os.path.join(folder, filename))
+            pruned += 1
+    return pruned
 
 
 def ensureExtension(filename, extension):
@@ -5,14 +5,18 @@ This script generates a report of which badges each Scout has.
 import os
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+from build_cache import BuildCache, code_files, normalise
 from datetime import date
 from docx import Document
 from docx.enum.section import WD_ORIENT
 from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Cm, Pt
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-from osm import AwardScheme, Connection, Manager, BadgeOrder
+from docx_builder import Picture, TableBuilder
+from memory_profile import MemoryProfile
+from osm import AwardScheme, Connection, Manager, BadgeOrder, DOWNLOAD_WORKERS
+from pipeline import prefetch
+from term_state import open_state
 
 class ReportGenerator(object):
 
@@ -36,30 +40,63 @@ class ReportGenerator(object):
             print('ERROR: term and section have not been set! ')
             return
 
+        memory = MemoryProfile()
         print('Connecting to OSM...')
         self._connect()
         self._initialise()
+        memory.checkpoint('loading sections')
 
         self._set_term(sys.argv[1:3])
         if self._term is None:
             return
 
+        store = None
+        if len(sys.argv) > 3 and sys.argv[3] == 'changed':
+            store = open_state(sys.argv[2], self._term)
+            if store is None:
+                return
+
         order_path = 'report-order-' + sys.argv[2] + '.json'
         print('Retrieving badge order from ' + order_path + '...')
         self._badge_order = BadgeOrder(order_path)
 
         print('Retrieving badge report...')
         report = self._term.load_badges_by_person(self._conn)
+        memory.checkpoint('loading badge report')
+
+        filename = sys.argv[2]+'-Badge Report'
+        if not store is None:
+            print('Finding changes since the last refresh...')
+            changed = store.diff().badge_members()
+            report = [person for person in report if str(person.member_id) in changed]
+            print('-> %d member(s) have changed' % (len(report), ))
+            filename += ' (changes)'
+
+        filename = ensureExtension(filename, '.docx')
+        cache = BuildCache()
+        # Rendering sorts the badges and can add new ones to the order, so keep the inputs as they were.
+        inputs = normalise(report)
+        files = code_files(__file__, 'docx_builder.py', 'pipeline.py', 'term_state.py') + [order_path]
+        if cache.is_current(filename, cache.key(inputs, files)):
+            print('-> %s is up to date' % (filename, ))
+            memory.report()
+            print('Done')
+            return
 
         print('Generating report...')
-        filename = ensureExtension(sys.argv[2]+'-Badge Report', '.docx')
         document = Document()
         self._generate_report(report, document)
-        self._badge_order.save(order_path)
+        if self._badge_order.save(order_path):
+            print('Updated badge order in %s' % (order_path, ))
+        memory.checkpoint('rendering')
 
         print('Saving to %s...' % (filename, ))
         document.save(filename)
+        # Recorded against the saved badge order, which is what the next run will read.
+        cache.update(filename, cache.key(inputs, files))
+        memory.checkpoint('saving')
 
+        memory.report()
         print('Done')
 
     def _set_term(self, args):
@@ -111,73 +148,51 @@ class ReportGenerator(object):
         section.header.paragraphs[0].text = 'Badge Report'
         now = date.today()
         section.footer.paragraphs[0].text = 'Generated ' + now.strftime('%d %B %Y')
-        table = document.add_table(rows = 1, cols = 2, style='Table Grid')
-        table.columns[0].width = Cm(5)
-        table.columns[1].width = Cm(21)
-        cells = table.rows[0].cells
-        cells[0].text = 'Person'
-        cells[1].text = 'Badges'
-        cells[0].width = Cm(5)
-        cells[1].width = Cm(21)
-        clearFormatting(cells[0].paragraphs[0], headingStyle)
-        clearFormatting(cells[1].paragraphs[0], headingStyle)
-        set_repeat_table_header(table.rows[0])
-        for person in [p for p in report if p.is_active]:
-            cells = table.add_row().cells
-            name = '%s %s' % (person.first_name, person.last_name)
-            print('...adding row for %s...' % (name, ))
-            cells[0].text = name
-            clearFormatting(cells[0].paragraphs[0])
-            para = cells[1].paragraphs[0]
-            clearFormatting(para)
-            cells[0].width = Cm(4)
-            cells[1].width = Cm(22)
-            person.badges.sort(key=self._sort_order)
-            all_badges = { b.badge_id : True for b in person.badges if b.completed }
-            for badge in person.badges:
-                if self._badge_order.remove_with(badge.badge_id) in all_badges:
-                    continue
-
-                _, file_extension = os.path.splitext(badge.picture)
-                badge_path = os.path.join('badge_images', badge.name + file_extension)
-                if not os.path.exists(badge_path):
-                    print('...retrieving badge image for %s...' % (badge.name,))
-                    self._conn.download_binary(badge.picture, badge_path)
-                if badge.completed:
-                    para.add_run().add_picture(badge_path, width = Cm(2))
-                    para.add_run(' ')
-        preventDocumentBreak(document)
-
-    def _sort_order(self, badge):
-        return self._badge_order.get_order(badge.badge_id, badge.name)
+        table = document.add_table(rows = 0, cols = 2, style='Table Grid')
+        builder = TableBuilder(document, table, [Cm(4), Cm(22)], spacing=Pt(3))
+        builder.add_row([['Person'], ['Badges']], style=headingStyle, header=True,
+                        widths=[Cm(5), Cm(21)])
+        people = [p for p in report if p.is_active]
+        self._badge_order.sort_badges(people)
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            downloads = {}
+
+            def start_downloads(person):
+                ''' Starts downloading the badge images for a row; called as the rows ahead are reached. '''
+                for badge, badge_path in self._row_badges(person):
+                    if not badge_path in downloads and not os.path.exists(badge_path):
+                        print('...retrieving badge image for %s...' % (badge.name,))
+                        downloads[badge_path] = executor.submit(self._conn.download_binary, badge.picture, badge_path)
+                return [downloads[badge_path] for _, badge_path in self._row_badges(person)
+                        if badge_path in downloads]
+
+            for person, images in prefetch(people, start_downloads):
+                name = '%s %s' % (person.first_name, person.last_name)
+                print('...adding row for %s...' % (name, ))
+                for image in images:
+                    image.result()
+                pictures = []
+                for badge, badge_path in self._row_badges(person):
+                    if badge.completed:
+                        pictures.append(Picture(badge_path, Cm(2)))
+                        pictures.append(' ')
+                builder.add_row([[name], pictures])
+        builder.build()
+
+    def _row_badges(self, person):
+        ''' The badges (and their image paths) shown for a person, leaving out those replaced by a later badge. '''
+        all_badges = { b.badge_id : True for b in person.badges if b.completed }
+        badges = []
+        for badge in person.badges:
+            if self._badge_order.remove_with(badge.badge_id) in all_badges:
+                continue
+            _, file_extension = os.path.splitext(badge.picture)
+            badges.append((badge, os.path.join('badge_images', badge.name + file_extension)))
+        return badges
 
 def ensureExtension(filename, extension):
     return filename if filename.lower().endswith(extension) else filename + extension
 
-def clearFormatting(paragraph, style=None):
-    paragraph.paragraph_format.space_before = Pt(3)
-    paragraph.paragraph_format.space_after = Pt(3)
-    if style is not None:
-        paragraph.style = style
-
-def set_repeat_table_header(row):
-    """ set repeat table row on every new page
-    """
-    tr = row._tr
-    trPr = tr.get_or_add_trPr()
-    tblHeader = OxmlElement('w:tblHeader')
-    tblHeader.set(qn('w:val'), "true")
-    trPr.append(tblHeader)
-    return row
-
-def preventDocumentBreak(document):
-  tags = document.element.xpath('//w:tr')
-  rows = len(tags)
-  for row in range(0,rows):
-    tag = tags[row]
-    child = OxmlElement('w:cantSplit')
-    tag.append(child)
-
 if __name__ == "__main__":
     mgr = ReportGenerator()
     mgr.run()
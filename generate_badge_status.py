@@ -2,12 +2,19 @@
 This script generates an Excel spreadsheet of where the division is for each requirement.
 '''
 
+import io
 import os
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+from build_cache import BuildCache, code_files
 from datetime import date
 import xlsxwriter
-from osm import AwardScheme, Connection, Manager
+from award_plan import AwardPlan
+from memory_profile import MemoryProfile
+from osm import AwardScheme, Connection, Journal, Manager, DOWNLOAD_WORKERS
+from pipeline import Pipeline, prefetch
+from term_state import open_state
 
 
 class ReportGenerator(object):
@@ -22,6 +29,11 @@ class ReportGenerator(object):
         self._conn = Connection('secret.json')
         self._conn.connect()
 
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
     def _initialise(self):
         self._mgr = Manager()
         self._mgr.load(self._conn)
@@ -29,18 +41,27 @@ class ReportGenerator(object):
             os.makedirs('temp_images')
 
     def run(self):
-        print('Connecting to OSM...')
-        self._connect()
-        self._initialise()
-
         if len(sys.argv) < 3:
             print('ERROR: term and section have not been set! ')
             return
 
+        memory = MemoryProfile()
+        print('Connecting to OSM...')
+        self._connect()
+        self._start_journal(ensureExtension(sys.argv[2]+'-Badge Status', '.journal'))
+        self._initialise()
+        memory.checkpoint('loading sections')
+
         self._set_term(sys.argv[1:3])
         if self._term is None:
             return
 
+        store = None
+        if len(sys.argv) > 3 and sys.argv[3] == 'changed':
+            store = open_state(sys.argv[2], self._term)
+            if store is None:
+                return
+
         print('Retrieving badge data...')
         scheme = AwardScheme(self._section.name + '-award.json')
         print('-> Loaded award scheme definition')
@@ -48,20 +69,51 @@ class ReportGenerator(object):
         badge_map = {}
         for badge in self._term.badges:
             badge_map[badge.badge_id] = badge
+        scheme.link(badge_map)
         print('-> Loaded badges')
 
         print('Retrieving members...')
         members = self._term.load_members(self._conn)
         print('-> Loaded members')
+        memory.checkpoint('loading members')
 
-        print('Generating report...')
-        filename = ensureExtension(sys.argv[2]+'-Badge Status', '.xlsx')
-        workbook = xlsxwriter.Workbook(filename)
-        self._generate_report(scheme, members, badge_map, workbook)
+        filename = sys.argv[2]+'-Badge Status'
+        changes = None
+        if not store is None:
+            print('Finding changes since the last refresh...')
+            changes = store.diff()
+            filename += ' (changes)'
 
-        print('Saving to %s...' % (filename, ))
+        award_plan = AwardPlan(scheme)
+        people, awards = self._select(award_plan, members, changes)
+        badges = dict((badge.badge_id, badge) for award in awards for badge in self._award_badges(award))
+
+        filename = ensureExtension(filename, '.xlsx')
+        cache = BuildCache()
+        files = code_files(__file__, 'award_plan.py', 'pipeline.py', 'term_state.py') + [self._section.name + '-award.json']
+
+        # The progress is only known once it has streamed in, so the report is rendered into
+        # memory as it arrives and only written out if it differs from the last build.
+        print('Generating report...')
+        output = io.BytesIO()
+        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        self._generate_report(award_plan, awards, people, workbook)
         workbook.close()
+        print('-> Loaded progress for %d badges' % (len(badges), ))
+        memory.checkpoint('loading progress and rendering')
 
+        key = cache.key([badges, people, changes], files)
+        if cache.is_current(filename, key):
+            print('-> %s is up to date' % (filename, ))
+        else:
+            print('Saving to %s...' % (filename, ))
+            with open(filename, 'wb') as f:
+                f.write(output.getvalue())
+            cache.update(filename, key)
+        memory.checkpoint('saving')
+
+        self._conn.journal.finish()
+        memory.report()
         print('Done')
 
     def _set_term(self, args):
@@ -96,104 +148,104 @@ class ReportGenerator(object):
             self._section = section
             print('-> Section set to %s' % (str(section), ))
     
-    def _generate_report(self, scheme, members, badge_map, workbook):
+    def _select(self, plan, members, changes=None):
+        ''' Gets the members and awards to show: all of them, or only those that have changed. '''
+        people = [member for member in members if member.patrol != 'Leaders']
+        awards = plan.awards
+        if not changes is None:
+            changed_members = changes.progress_members()
+            changed_badges = changes.progress_badges()
+            people = [member for member in people if str(member.member_id) in changed_members]
+            awards = [award for award in awards if any(
+                badge.badge.badge_id in changed_badges
+                for badge in [award.complete] + [part.badge for part in award.parts]
+                if not badge is None)]
+            print('-> %d member(s) and %d award(s) have changed' % (len(people), len(awards)))
+        return people, awards
+
+    def _generate_report(self, plan, awards, people, workbook):
         bold_format = workbook.add_format({'bold': True, 'font_size': 12})
         progress_format = workbook.add_format({'num_format': '0.00'})
-        for badge in scheme.badges:
-            print('-> Processing ' + badge.name)
-            ws_name = badge.name
-            if len(ws_name) > 30:
-                ws_name = ws_name[0:27] + '...'
-            worksheet = workbook.add_worksheet(ws_name)
-            worksheet.write('A1', badge.name, bold_format)
-            worksheet.write('A2', 'First Name', bold_format)
-            worksheet.write('B2', 'Family Name', bold_format)
-            worksheet.write('C2', 'Awarded', bold_format)
-
-            row = 3 if badge.group else 2
-            member_map = {}
-            for member in members:
-                if member.patrol != 'Leaders':
-                    member_map[member.member_id] = row
-                    worksheet.write(row, 0, member.first_name)
-                    worksheet.write(row, 1, member.last_name)
-                    row += 1
-
-            if not badge.complete_id is None:
-                complete_badge = badge_map[badge.complete_id]
-                complete_badge.load_progress(self._conn)
-                print('-> Loaded "%s"...' % (complete_badge.name,))
-                for member in complete_badge.progress:
-                    worksheet.write(member_map[member.member_id], 2, 'Yes' if member.completed else 'No')
-
-            column = 3
-            for part in badge.parts:
-                worksheet.write(1, column, part.name, bold_format)
-                part.badge = badge_map[part.id]
-                if not part.badge.progress_loaded:
-                    part.badge.load_progress(self._conn)
-                    print('-> Loaded "%s"...' % (part.badge.name,))
-                part_progress = {}
-
-                part_count = 1
-                groups = {}
-                if part.group:
-                    last_part = ''
-                    part_count = 0
-                    for badge_part in part.badge.parts:
-                        this_part = badge_part.name.strip()
-                        if last_part != this_part:
-                            last_part = this_part
-                            worksheet.write(2, column + part_count, last_part, bold_format)
-                            groups[last_part] = []
-                            part_count += 1
-                        groups[last_part].append(badge_part.part_id)
-                else:
-                    groups['all'] = len(part.badge.parts)
-
-                print('--> Calculating progress')
-                for item in part.badge.progress:
-                    if item.completed:
-                        part_progress[item.member_id] = [1.0 for _ in range(part_count)]
-                    else:
-                        if part.group:
-                            part_progress[item.member_id] = [0.0 for _ in range(part_count)]
-                            pos = 0
-                            for grp_list in groups.values():
-                                count = 0
-                                for id in grp_list:
-                                    if id in item.parts:
-                                        count += 1
-                                actual_progress = count / len(grp_list)
-                                part_progress[item.member_id][pos] = actual_progress
-                                pos += 1
-                        else:
-                            total = len(item.parts)
-                            part_progress[item.member_id] = [total / groups['all']]
-
-                print('--> Exporting')
-                for member in member_map.keys():
-                    row = member_map[member]
-                    item_progress = part_progress[member]
-                    for loop in range(part_count):
-                        worksheet.write(row, column + loop, item_progress[loop], progress_format)
-
-                column += part_count
-        
-            last_column = xlsxwriter.utility.xl_col_to_name(column - 1)
-            last_row = str(len(members) + (3 if badge.group else 2))
-            range_to_format = ('D4' if badge.group else 'D3') + ':' + last_column + last_row
-            worksheet.conditional_format(range_to_format, 
-                {
-                    'type': 'icon_set',
-                    'icon_style': '5_arrows',
-                    'icons': [
-                        {'criteria': '>', 'type': 'number', 'value': 0.99},
-                        {'criteria': '>', 'type': 'number', 'value': 0.75},
-                        {'criteria': '>', 'type': 'number', 'value': 0.50},
-                        {'criteria': '>', 'type': 'number', 'value': 0.25}
-                    ]
-                })
+
+        print('-> Evaluating award scheme')
+        result = plan.evaluate([member.member_id for member in people])
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            loads = {}
+
+            def start_loads(award):
+                ''' Starts loading the progress an award needs; called as the awards ahead are reached. '''
+                for badge in self._award_badges(award):
+                    if not badge.badge_id in loads and not badge.progress_loaded:
+                        loads[badge.badge_id] = executor.submit(badge.load_progress, self._conn)
+                return [loads[badge.badge_id] for badge in self._award_badges(award) if badge.badge_id in loads]
+
+            stages = [self._wait_for_award,
+                      lambda award: self._evaluate_award(result, award)]
+            for item in Pipeline(stages).run(prefetch(awards, start_loads)):
+                self._write_award(item, people, workbook, bold_format, progress_format)
+
+    def _write_award(self, item, people, workbook, bold_format, progress_format):
+        award, awarded, part_values = item
+        print('-> Processing ' + award.name)
+        ws_name = award.name
+        if len(ws_name) > 30:
+            ws_name = ws_name[0:27] + '...'
+        worksheet = workbook.add_worksheet(ws_name)
+        worksheet.write('A1', award.name, bold_format)
+        worksheet.write('A2', 'First Name', bold_format)
+        worksheet.write('B2', 'Family Name', bold_format)
+        worksheet.write('C2', 'Awarded', bold_format)
+
+        first_row = 3 if award.group else 2
+        for row, member in enumerate(people, first_row):
+            worksheet.write(row, 0, member.first_name)
+            worksheet.write(row, 1, member.last_name)
+
+        if not awarded is None:
+            for row in awarded.present.nonzero()[0]:
+                worksheet.write(first_row + row, 2, 'Yes' if awarded.completed[row] else 'No')
+
+        column = 3
+        for part, values in zip(award.parts, part_values):
+            worksheet.write(1, column, part.name, bold_format)
+            if part.group:
+                worksheet.write_row(2, column, part.columns, bold_format)
+
+            for row, member_values in enumerate(values, first_row):
+                worksheet.write_row(row, column, member_values, progress_format)
+            column += len(part.columns)
+    
+        last_column = xlsxwriter.utility.xl_col_to_name(column - 1)
+        last_row = str(len(people) + first_row)
+        range_to_format = ('D4' if award.group else 'D3') + ':' + last_column + last_row
+        worksheet.conditional_format(range_to_format, 
+            {
+                'type': 'icon_set',
+                'icon_style': '5_arrows',
+                'icons': [
+                    {'criteria': '>', 'type': 'number', 'value': 0.99},
+                    {'criteria': '>', 'type': 'number', 'value': 0.75},
+                    {'criteria': '>', 'type': 'number', 'value': 0.50},
+                    {'criteria': '>', 'type': 'number', 'value': 0.25}
+                ]
+            })
+
+    def _award_badges(self, award):
+        badges = [part.badge.badge for part in award.parts]
+        if not award.complete is None:
+            badges.append(award.complete.badge)
+        return badges
+
+    def _wait_for_award(self, item):
+        ''' Waits until the progress for the badges of an award has been loaded. '''
+        award, loads = item
+        for load in loads:
+            load.result()
+        return award
+
+    def _evaluate_award(self, result, award):
+        awarded = None if award.complete is None else result.badge(award.complete)
+        return award, awarded, [result.part_values(part).tolist() for part in award.parts]
 
 
 def ensureExtension(filename, extension):
@@ -0,0 +1,161 @@
+'''
+This script generates a report of what has changed in a term since the last time it was run.
+'''
+
+import sys
+
+from datetime import date
+from docx import Document
+from docx_builder import ParagraphWriter
+from memory_profile import MemoryProfile
+from osm import Connection, Journal, Manager
+from term_state import StateStore, TermState
+
+
+class ReportGenerator(object):
+
+    def __init__(self):
+        self._conn = None
+        self._mgr = None
+        self._section = None
+        self._term = None
+
+    def _connect(self):
+        self._conn = Connection('secret.json')
+        self._conn.connect()
+
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
+    def _initialise(self):
+        self._mgr = Manager()
+        self._mgr.load(self._conn)
+
+    def run(self):
+        if len(sys.argv) < 3:
+            print('ERROR: term and section have not been set! ')
+            return
+
+        memory = MemoryProfile()
+        print('Connecting to OSM...')
+        self._connect()
+        self._start_journal(ensureExtension(sys.argv[2]+'-Changes', '.journal'))
+        self._initialise()
+        memory.checkpoint('loading sections')
+
+        self._set_term(sys.argv[1:3])
+        if self._term is None:
+            return
+
+        print('Retrieving members...')
+        self._term.load_members(self._conn)
+        memory.checkpoint('loading members')
+        print('Retrieving badges...')
+        self._term.load_badges(self._conn)
+        self._term.load_progress(self._conn)
+        print('Retrieving badge report...')
+        report = self._term.load_badges_by_person(self._conn)
+        print('Retrieving term programme...')
+        self._term.load_programme(self._conn, include_attendance=True)
+        memory.checkpoint('loading progress')
+
+        print('Comparing with the last run...')
+        store = StateStore(sys.argv[2] + '-state.json', self._term.term_id)
+        changes = store.rotate(TermState.from_term(self._term, report))
+        if not changes.has_changes():
+            print('-> No changes')
+
+        print('Generating report...')
+        filename = ensureExtension(sys.argv[2]+'-Changes', '.docx')
+        document = Document()
+        self._generate_header_footer(document)
+        self._generate_report(changes, document)
+        memory.checkpoint('rendering')
+
+        print('Saving to %s...' % (filename, ))
+        document.save(filename)
+        memory.checkpoint('saving')
+
+        self._conn.journal.finish()
+        memory.report()
+        print('Done')
+
+    def _set_term(self, args):
+        term_name = args[0]
+        self._set_section(args[1:])
+
+        print('Setting term...')
+        if term_name == 'current':
+            term = self._section.current_term()
+            if term is None:
+                print('-> Currently not in a term')
+                return
+            else:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        for term in self._section.terms:
+            if term.name == term_name:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        print('-> Unknown term: %s' % (term_name, ))
+
+    def _set_section(self, args):
+        print('Setting section...')
+        section = self._mgr.find_section(args[0])
+        if section is None:
+            print('-> Unknown section: %s' % (args[0], ))
+        else:
+            self._section = section
+            print('-> Section set to %s' % (str(section), ))
+
+    def _generate_header_footer(self, document):
+        now = date.today()
+        section = document.sections[0]
+        section.header.paragraphs[0].text = 'Changes Since Last Run'
+        section.footer.paragraphs[0].text = 'Generated ' + now.strftime('%d %B %Y')
+
+    def _generate_report(self, changes, document):
+        badges = dict((badge.badge_id, badge) for badge in self._term.badges)
+        parts = dict((part.part_id, part.name.strip()) for badge in self._term.badges for part in badge.parts)
+        heading = document.styles['Heading 1']
+        writer = ParagraphWriter(document)
+
+        def add_section(title, keys, describe):
+            if len(keys) == 0:
+                return
+            writer.add_paragraph('%s (%d)' % (title, len(keys)), heading)
+            for key in keys:
+                fields = key.split(' ', 2)
+                writer.add_paragraph('%s: %s' % (changes.members.get(fields[0], fields[0]), describe(fields)))
+            writer.flush()
+            print('-> %s: %d' % (title, len(keys)))
+
+        def badge_name(badge_id):
+            try:
+                return badges[badge_id].name
+            except KeyError:
+                return badge_id
+
+        add_section('New Members', changes.new_members, lambda fields: 'joined')
+        add_section('Left', changes.left_members, lambda fields: 'left')
+        add_section('Badges Completed', changes.new_links, lambda fields: fields[2])
+        add_section('Badges Awarded', changes.new_awarded, lambda fields: fields[2])
+        add_section('Badge Progress Completed', changes.new_completed, lambda fields: badge_name(fields[1]))
+        add_section('Parts Completed', changes.new_parts,
+                    lambda fields: '%s - %s' % (badge_name(fields[1]), parts.get(fields[2], fields[2])))
+        add_section('Attended', changes.attended, lambda fields: fields[1])
+        add_section('Attendance Removed', changes.unattended, lambda fields: fields[1])
+
+
+def ensureExtension(filename, extension):
+    return filename if filename.lower().endswith(extension) else filename + extension
+
+if __name__ == "__main__":
+    mgr = ReportGenerator()
+    mgr.run()
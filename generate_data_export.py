@@ -0,0 +1,219 @@
+'''
+This script exports the members, badges, badge progress and attendance for a term as columnar Parquet or Feather tables.
+
+Each table is written to <section>-Export/<table>/term=<term id>/, so every term exported is kept.
+'''
+
+import os
+import sys
+
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as parquet
+from memory_profile import MemoryProfile
+from osm import Connection, Journal, Manager
+
+
+class ReportGenerator(object):
+
+    def __init__(self):
+        self._conn = None
+        self._mgr = None
+        self._section = None
+        self._term = None
+
+    def _connect(self):
+        self._conn = Connection('secret.json')
+        self._conn.connect()
+
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
+    def _initialise(self):
+        self._mgr = Manager()
+        self._mgr.load(self._conn)
+
+    def run(self):
+        if len(sys.argv) < 3:
+            print('ERROR: term and section have not been set! ')
+            return
+
+        export_format = 'parquet'
+        if len(sys.argv) > 3:
+            export_format = sys.argv[3]
+        if not export_format in ('parquet', 'feather'):
+            print('ERROR: unknown export format "%s"! ' % (export_format, ))
+            return
+
+        memory = MemoryProfile()
+        print('Connecting to OSM...')
+        self._connect()
+        self._start_journal(ensureExtension(sys.argv[2]+'-Export', '.journal'))
+        self._initialise()
+        memory.checkpoint('loading sections')
+
+        self._set_term(sys.argv[1:3])
+        if self._term is None:
+            return
+
+        print('Retrieving members...')
+        members = self._term.load_members(self._conn)
+        memory.checkpoint('loading members')
+        print('Retrieving badges...')
+        self._term.load_badges(self._conn)
+        self._term.load_progress(self._conn)
+        print('Retrieving badge report...')
+        report = self._term.load_badges_by_person(self._conn)
+        print('Retrieving term programme...')
+        programme = self._term.load_programme(self._conn, include_attendance=True)
+        memory.checkpoint('loading progress')
+
+        print('Generating tables...')
+        tables = {
+            'members': self._members_table(members),
+            'badge_parts': self._badge_parts_table(self._term.badges),
+            'badge_completion': self._badge_completion_table(self._term.badges),
+            'badge_progress': self._badge_progress_table(self._term.badges),
+            'badge_links': self._badge_links_table(report),
+            'attendance': self._attendance_table(programme),
+        }
+        memory.checkpoint('building tables')
+
+        # Each term is a partition of its own (<section>-Export/<table>/term=<id>/), so the
+        # exports for a year of terms can be scanned together as one dataset.
+        for name, table in tables.items():
+            table = self._add_term_columns(table)
+            folder = os.path.join(sys.argv[2] + '-Export', name, 'term=%s' % (self._term.term_id, ))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            filename = os.path.join(folder, 'part.' + export_format)
+            print('Saving %d rows to %s...' % (table.num_rows, filename))
+            if export_format == 'parquet':
+                parquet.write_table(table, filename)
+            else:
+                feather.write_feather(table, filename)
+        memory.checkpoint('saving')
+
+        self._conn.journal.finish()
+        memory.report()
+        print('Done')
+
+    def _set_term(self, args):
+        term_name = args[0]
+        self._set_section(args[1:])
+
+        print('Setting term...')
+        if term_name == 'current':
+            term = self._section.current_term()
+            if term is None:
+                print('-> Currently not in a term')
+                return
+            else:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        for term in self._section.terms:
+            if term.name == term_name:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        print('-> Unknown term: %s' % (term_name, ))
+
+    def _set_section(self, args):
+        print('Setting section...')
+        section = self._mgr.find_section(args[0])
+        if section is None:
+            print('-> Unknown section: %s' % (args[0], ))
+        else:
+            self._section = section
+            print('-> Section set to %s' % (str(section), ))
+
+    def _add_term_columns(self, table):
+        ''' Adds the section and term to every row, so the rows can still be told apart once several terms are combined. '''
+        table = table.append_column('section_id', ids([self._section.section_id] * table.num_rows))
+        return table.append_column('term_id', ids([self._term.term_id] * table.num_rows))
+
+    def _members_table(self, members):
+        return pa.table({
+            'member_id': ids(member.member_id for member in members),
+            'first_name': pa.array([member.first_name for member in members], pa.string()),
+            'last_name': pa.array([member.last_name for member in members], pa.string()),
+            'patrol': ids(member.patrol for member in members),
+            'role': ids(member.role for member in members),
+            'active': pa.array([bool(member.is_active) for member in members], pa.bool_()),
+            'date_of_birth': pa.array([parse_date(member.date_of_birth) for member in members], pa.date32()),
+        })
+
+    def _badge_parts_table(self, badges):
+        rows = [(badge, part) for badge in badges for part in badge.parts]
+        return pa.table({
+            'badge_id': ids(badge.badge_id for badge, _ in rows),
+            'badge_name': ids(badge.name for badge, _ in rows),
+            'badge_type': ids(badge.type for badge, _ in rows),
+            'part_id': ids(part.part_id for _, part in rows),
+            'part_name': pa.array([part.name for _, part in rows], pa.string()),
+            'description': pa.array([part.description for _, part in rows], pa.string()),
+        })
+
+    def _badge_completion_table(self, badges):
+        rows = [(badge, person) for badge in badges for person in badge.progress]
+        return pa.table({
+            'badge_id': ids(badge.badge_id for badge, _ in rows),
+            'member_id': ids(person.member_id for _, person in rows),
+            'completed': pa.array([person.completed for _, person in rows], pa.bool_()),
+            'parts_completed': pa.array([len(person.parts) for _, person in rows], pa.int16()),
+        })
+
+    def _badge_progress_table(self, badges):
+        rows = [(badge.badge_id, person.member_id, part_id, value)
+                for badge in badges
+                for person in badge.progress
+                for part_id, value in person.parts.items()]
+        return pa.table({
+            'badge_id': ids(row[0] for row in rows),
+            'member_id': ids(row[1] for row in rows),
+            'part_id': ids(row[2] for row in rows),
+            'value': pa.array([row[3] for row in rows], pa.string()),
+        })
+
+    def _badge_links_table(self, report):
+        rows = [(person, badge) for person in report for badge in person.badges]
+        return pa.table({
+            'member_id': ids(person.member_id for person, _ in rows),
+            'badge_id': ids(badge.badge_id for _, badge in rows),
+            'badge_name': ids(badge.name for _, badge in rows),
+            'completed': pa.array([badge.completed for _, badge in rows], pa.bool_()),
+            'awarded': pa.array([badge.awarded for _, badge in rows], pa.bool_()),
+        })
+
+    def _attendance_table(self, programme):
+        rows = [(meeting, member) for meeting in programme for member in meeting.members]
+        return pa.table({
+            'meeting_date': pa.array([meeting.date for meeting, _ in rows], pa.date32()),
+            'meeting_name': ids(meeting.name for meeting, _ in rows),
+            'member_id': ids(member.member_id for _, member in rows),
+        })
+
+
+def ensureExtension(filename, extension):
+    return filename if filename.lower().endswith(extension) else filename + extension
+
+def ids(values):
+    ''' Builds a dictionary-encoded string column. '''
+    return pa.array([None if value is None else str(value) for value in values],
+                    pa.string()).dictionary_encode()
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+if __name__ == "__main__":
+    mgr = ReportGenerator()
+    mgr.run()
@@ -0,0 +1,220 @@
+'''
+This script generates a summary of award scheme status, attendance and badges across every section in the group.
+'''
+
+import os
+import sys
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import numpy as np
+import xlsxwriter
+from award_plan import AwardPlan
+from memory_profile import MemoryProfile
+from osm import AwardScheme, Connection, FetchPlan, Journal, Manager
+
+# Number of sections to load at the same time; each also loads its badges concurrently.
+SECTION_WORKERS = 4
+
+SectionSummary = namedtuple('SectionSummary', ['section', 'term', 'members', 'attendance',
+                                               'meetings', 'badges', 'awards'])
+AwardSummary = namedtuple('AwardSummary', ['name', 'awarded', 'progress'])
+
+
+class ReportGenerator(object):
+
+    def __init__(self):
+        self._conn = None
+        self._mgr = None
+
+    def _connect(self):
+        self._conn = Connection('secret.json')
+        self._conn.connect()
+
+    def _start_journal(self, path):
+        self._conn.journal = Journal(path)
+        if len(self._conn.journal) > 0:
+            print('-> Resuming: %d fetches already completed' % (len(self._conn.journal), ))
+
+    def _initialise(self):
+        self._mgr = Manager()
+        self._mgr.load(self._conn)
+
+    def run(self):
+        term_name = sys.argv[1] if len(sys.argv) > 1 else 'current'
+
+        memory = MemoryProfile()
+        print('Connecting to OSM...')
+        self._connect()
+        self._start_journal('Group-Rollup.journal')
+        self._initialise()
+        memory.checkpoint('loading sections')
+        if len(self._mgr.sections) == 0:
+            print('ERROR: no sections found! ')
+            return
+
+        print('Loading %d sections...' % (len(self._mgr.sections), ))
+        with ThreadPoolExecutor(max_workers=min(SECTION_WORKERS, len(self._mgr.sections))) as executor:
+            summaries = [summary for summary in executor.map(
+                lambda section: self._summarise(section, term_name), self._mgr.sections)
+                if not summary is None]
+        memory.checkpoint('loading progress')
+
+        print('Generating report...')
+        filename = ensureExtension(self._mgr.sections[0].group + '-Rollup', '.xlsx')
+        workbook = xlsxwriter.Workbook(filename)
+        self._generate_report(summaries, workbook)
+        memory.checkpoint('rendering')
+
+        print('Saving to %s...' % (filename, ))
+        workbook.close()
+        memory.checkpoint('saving')
+
+        self._conn.journal.finish()
+        memory.report()
+        print('Done')
+
+    def _find_term(self, section, term_name):
+        if term_name == 'current':
+            return section.current_term()
+        for term in section.terms:
+            if term.name == term_name:
+                return term
+        return None
+
+    def _summarise(self, section, term_name):
+        ''' Loads and aggregates the data for one section. '''
+        term = self._find_term(section, term_name)
+        if term is None:
+            print('-> %s: no term %s' % (section.name, term_name))
+            return None
+
+        members = [member for member in term.load_members(self._conn) if member.patrol != 'Leaders']
+        member_ids = [str(member.member_id) for member in members]
+        attendance, meetings = self._attendance(term, member_ids)
+        badges = self._badge_counts(term.load_badges_by_person(self._conn), set(member_ids))
+        awards = self._award_status(section, term, [member.member_id for member in members])
+        print('-> Loaded %s (%s)' % (section.name, term.name))
+        return SectionSummary(section, term, len(members), attendance, meetings, badges, awards)
+
+    def _attendance(self, term, member_ids):
+        ''' Gets the attendance matrix (members x past meetings) and the dates of the meetings. '''
+        today = date.today()
+        meetings = [meeting for meeting in term.load_programme(self._conn, include_attendance=True)
+                    if meeting.date <= today]
+        index = dict((member_id, row) for row, member_id in enumerate(member_ids))
+        attended = np.zeros((len(member_ids), len(meetings)), dtype=bool)
+        for column, meeting in enumerate(meetings):
+            rows = [index[str(member.member_id)] for member in meeting.members
+                    if str(member.member_id) in index]
+            attended[rows, column] = True
+        return attended, [meeting.date for meeting in meetings]
+
+    def _badge_counts(self, report, member_ids):
+        ''' Counts the badges completed, awarded and waiting to be awarded. '''
+        links = np.array([(link.completed, link.awarded) for person in report
+                          if str(person.member_id) in member_ids
+                          for link in person.badges], dtype=bool).reshape(-1, 2)
+        completed, awarded = links[:, 0], links[:, 1]
+        return (int(completed.sum()), int(awarded.sum()), int((completed & ~awarded).sum()))
+
+    def _award_status(self, section, term, member_ids):
+        ''' Gets the number of members who have each award and their mean progress towards it. '''
+        path = section.name + '-award.json'
+        if not os.path.exists(path):
+            return []
+
+        scheme = AwardScheme(path)
+        term.load_badges(self._conn)
+        badge_map = dict((badge.badge_id, badge) for badge in term.badges)
+        try:
+            plan = FetchPlan(scheme, badge_map)
+        except KeyError as e:
+            print('-> %s: badge %s in %s is not in the term' % (section.name, e, path))
+            return []
+        plan.fetch(term, self._conn)
+
+        result = AwardPlan(scheme).evaluate(member_ids)
+        awards = []
+        for award in result.plan.awards:
+            columns = [result.part_values(part) for part in award.parts]
+            values = np.hstack(columns) if len(columns) > 0 else np.zeros((len(member_ids), 0))
+            progress = values.mean(axis=1) if values.shape[1] > 0 else np.zeros(len(member_ids))
+            if award.complete is None:
+                awarded = progress >= 1.0
+            else:
+                awarded = result.badge(award.complete).completed
+            awards.append(AwardSummary(award.name, awarded, progress))
+        return awards
+
+    def _generate_report(self, summaries, workbook):
+        bold = workbook.add_format({'bold': True, 'font_size': 12})
+        percent = workbook.add_format({'num_format': '0%'})
+        bold_percent = workbook.add_format({'bold': True, 'num_format': '0%'})
+
+        print('-> Writing summary')
+        worksheet = workbook.add_worksheet('Summary')
+        worksheet.write_row(0, 0, ['Section', 'Term', 'Members', 'Meetings', 'Attendance',
+                                   'Badges Completed', 'Badges Awarded', 'Waiting for Award'], bold)
+        row = 1
+        for summary in summaries:
+            worksheet.write_row(row, 0, [summary.section.name, summary.term.name,
+                                         summary.members, len(summary.meetings)])
+            worksheet.write(row, 4, rate(summary.attendance.sum(), summary.attendance.size), percent)
+            worksheet.write_row(row, 5, list(summary.badges))
+            row += 1
+        attended = sum(int(summary.attendance.sum()) for summary in summaries)
+        possible = sum(summary.attendance.size for summary in summaries)
+        badges = np.array([summary.badges for summary in summaries], dtype=int).reshape(-1, 3).sum(axis=0)
+        worksheet.write_row(row, 0, ['Group', '', sum(summary.members for summary in summaries),
+                                     sum(len(summary.meetings) for summary in summaries)], bold)
+        worksheet.write(row, 4, rate(attended, possible), bold_percent)
+        worksheet.write_row(row, 5, badges.tolist(), bold)
+
+        print('-> Writing award status')
+        worksheet = workbook.add_worksheet('Award Status')
+        worksheet.write_row(0, 0, ['Section', 'Award', 'Awarded', 'Awarded %', 'Mean Progress',
+                                   'Over Half Way'], bold)
+        row = 1
+        group = {}
+        for summary in summaries:
+            for award in summary.awards:
+                self._write_award(worksheet, row, [summary.section.name, award.name],
+                                  award.awarded, award.progress, percent)
+                group.setdefault(award.name, []).append(award)
+                row += 1
+        for name, awards in group.items():
+            self._write_award(worksheet, row, ['Group', name],
+                              np.concatenate([award.awarded for award in awards]),
+                              np.concatenate([award.progress for award in awards]), bold_percent)
+            row += 1
+
+        print('-> Writing attendance')
+        worksheet = workbook.add_worksheet('Attendance')
+        worksheet.write_row(0, 0, ['Section', 'Meeting', 'Present', 'Attendance'], bold)
+        row = 1
+        for summary in summaries:
+            present = summary.attendance.sum(axis=0)
+            for column, meeting_date in enumerate(summary.meetings):
+                worksheet.write_row(row, 0, [summary.section.name, meeting_date.strftime('%d-%m-%Y'),
+                                             int(present[column])])
+                worksheet.write(row, 3, rate(present[column], summary.members), percent)
+                row += 1
+
+    def _write_award(self, worksheet, row, names, awarded, progress, number_format):
+        worksheet.write_row(row, 0, names + [int(awarded.sum())])
+        worksheet.write(row, 3, rate(awarded.sum(), len(awarded)), number_format)
+        worksheet.write(row, 4, float(progress.mean()) if len(progress) > 0 else 0.0, number_format)
+        worksheet.write(row, 5, int((progress >= 0.5).sum()))
+
+
+def rate(count, total):
+    return float(count) / total if total > 0 else 0.0
+
+def ensureExtension(filename, extension):
+    return filename if filename.lower().endswith(extension) else filename + extension
+
+if __name__ == "__main__":
+    mgr = ReportGenerator()
+    mgr.run()
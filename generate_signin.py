@@ -5,11 +5,17 @@ This script generates a generic sign-in sheet.
 import os
 import sys
 
+from build_cache import BuildCache, code_files
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
 from datetime import date
+from io import BytesIO
 from docx import Document
 from docx.enum.section import WD_ORIENT
 from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Cm, Pt
+from docx.table import _Cell
+from memory_profile import MemoryProfile
 from osm import AwardScheme, Connection, Manager
 
 
@@ -20,6 +26,8 @@ class ReportGenerator(object):
         self._mgr = None
         self._section = None
         self._term = None
+        self._cache = None
+        self._cache_files = None
 
     def _connect(self):
         self._conn = Connection('secret.json')
@@ -34,9 +42,11 @@ class ReportGenerator(object):
             print('ERROR: term and section have not been set! ')
             return
 
+        memory = MemoryProfile()
         print('Connecting to OSM...')
         self._connect()
         self._initialise()
+        memory.checkpoint('loading sections')
 
         self._set_term(sys.argv[1:3])
         if self._term is None:
@@ -44,12 +54,21 @@ class ReportGenerator(object):
 
         print('Retrieving members...')
         members = self._term.load_members(self._conn, include_data=True)
+        memory.checkpoint('loading members')
 
         print('Retrieving term programme...')
         programme = self._term.load_programme(self._conn)
         now = date.today()
         night = programme[0]
 
+        print('Preparing template...')
+        template_path = ensureExtension(sys.argv[2]+'-Signin-Template', '.docx')
+        template = SigninTemplate(template_path)
+        rows = self._extract_rows(members)
+        self._cache = BuildCache()
+        self._cache_files = code_files(__file__) + [template_path]
+        memory.checkpoint('preparing template')
+
         print('Generating sign-in sheet(s)...')
         night_to_find = 'next'
         if len(sys.argv) > 3:
@@ -60,30 +79,46 @@ class ReportGenerator(object):
                 night = day
                 if day.date >= now:
                     break
-            self.generate_sign_in_for_night(members, night)
+            self.generate_sign_in_for_night(template, rows, night)
         elif night_to_find == 'last':
             for day in programme:
                 if day.date > now:
                     break
                 night = day
-            self.generate_sign_in_for_night(members, night)
+            self.generate_sign_in_for_night(template, rows, night)
         elif night_to_find == 'all':
-            for day in programme:
-                self.generate_sign_in_for_night(members, day)
+            jobs = [self._night_job(day) for day in programme]
+            keys = dict((job[2], self._cache.key([rows, job], self._cache_files)) for job in jobs)
+            pending = [job for job in jobs if not self._cache.is_current(job[2], keys[job[2]])]
+            if len(pending) < len(jobs):
+                print('-> %d sign-in sheet(s) are up to date' % (len(jobs) - len(pending), ))
+            if len(pending) > 0:
+                with ProcessPoolExecutor(initializer=_init_worker, initargs=(template, rows)) as executor:
+                    for filename in executor.map(_render_night, pending):
+                        self._cache.update(filename, keys[filename])
+                        print('-> Saved %s' % (filename, ))
         else:
             print('Unknown night selection option: "' + night_to_find + '"')
+        memory.checkpoint('rendering and saving')
 
+        memory.report()
         print('Done')
 
-    def generate_sign_in_for_night(self, members, night):
+    def generate_sign_in_for_night(self, template, rows, night):
         print('Generating sign-in for "' + night.name + '"...')
-        template = ensureExtension(sys.argv[2]+'-Signin-Template', '.docx')
-        filename = ensureExtension(sys.argv[2]+' Sign in Sheet - ' + night.date.strftime('%Y%m%d'), '.docx')
-        document = Document(template)
-        self._generate_report(members, document, night)
+        job = self._night_job(night)
+        date_text, activity, filename = job
+        key = self._cache.key([rows, job], self._cache_files)
+        if self._cache.is_current(filename, key):
+            print('-> %s is up to date' % (filename, ))
+            return
+        template.render(date_text, activity, rows, filename)
+        self._cache.update(filename, key)
+        print('Saved to %s' % (filename, ))
 
-        print('Saving to %s...' % (filename, ))
-        document.save(filename)
+    def _night_job(self, night):
+        filename = ensureExtension(sys.argv[2]+' Sign in Sheet - ' + night.date.strftime('%Y%m%d'), '.docx')
+        return (night.date.strftime('%d %B %Y'), night.name, filename)
 
     def _set_term(self, args):
         term_name = args[0]
@@ -117,14 +152,7 @@ class ReportGenerator(object):
             self._section = section
             print('-> Section set to %s' % (str(section), ))
     
-    def _generate_report(self, members, doc, night):
-        for para in doc.paragraphs:
-            for run in para.runs:
-                if run.text == '{{date}}':
-                    run.text = night.date.strftime('%d %B %Y')
-                if run.text == '{{activity}}':
-                    run.text = night.name
-
+    def _extract_rows(self, members):
         print('...extracting data')
         report_data = []
         for person in members:
@@ -132,6 +160,7 @@ class ReportGenerator(object):
                 continue
 
             name = '%s %s' % (person.first_name.strip(), person.last_name.strip())
+            contact_person, contact_number = '', ''
             try:
                 contact = person.custom_data['contact_primary_1']
             except KeyError:
@@ -151,21 +180,91 @@ class ReportGenerator(object):
                         contact_number = ''
             report_data.append([name, contact_person, contact_number])                 
 
-        print('...populating table')
         report_data.sort(key=lambda r:r[0])
-        row = 1
-        table = doc.tables[0]
-        for person in report_data:            
-            try:
-                cells = table.rows[row].cells
-            except IndexError:
-                print('!! ERROR !! Table full - unable to add additional members !! EROR !!')
-            row += 1
-            print('...adding row for %s...' % (person[0], ))
-            cells[1].text = person[0]
-            cells[4].text = person[1]
-            cells[5].text = person[2]
+        return report_data
+
+
+class SigninTemplate(object):
+    ''' A sign-in template that is parsed once and copied for each night. '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._source = f.read()
+        self._document = None
+        self._body = None
+        document = self._load()
+
+        self._placeholders = []
+        for p_index, para in enumerate(document.paragraphs):
+            for r_index, run in enumerate(para.runs):
+                if run.text in ('{{date}}', '{{activity}}'):
+                    self._placeholders.append((p_index, r_index, run.text))
+
+        table = document.tables[0]
+        tr_list = table._tbl.tr_lst
+        self._slots = []
+        for row in table.rows[1:]:
+            cells = row.cells
+            tc_list = row._tr.tc_lst
+            self._slots.append((tr_list.index(row._tr),
+                                [tc_list.index(cells[col]._tc) for col in SLOT_COLUMNS]))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_document'] = None
+        state['_body'] = None
+        return state
+
+    def _load(self):
+        if self._document is None:
+            self._document = Document(BytesIO(self._source))
+            self._body = deepcopy(self._document.element.body)
+        return self._document
+
+    def render(self, date_text, activity, rows, filename):
+        ''' Renders the sheet for a night from a fresh copy of the template. '''
+        document = self._load()
+        body = document.element.body
+        for child in list(body):
+            body.remove(child)
+        for child in self._body:
+            body.append(deepcopy(child))
+
+        values = {'{{date}}': date_text, '{{activity}}': activity}
+        paragraphs = document.paragraphs
+        for p_index, r_index, placeholder in self._placeholders:
+            paragraphs[p_index].runs[r_index].text = values[placeholder]
+
+        if len(rows) > len(self._slots):
+            print('!! ERROR !! Table full - unable to add additional members !! EROR !!')
+        table = document.tables[0]
+        tr_list = table._tbl.tr_lst
+        for (row, cols), person in zip(self._slots, rows):
+            tc_list = tr_list[row].tc_lst
+            for col, value in zip(cols, person):
+                _Cell(tc_list[col], table).text = value
+
+        document.save(filename)
+        return filename
+
+
+_worker_template = None
+_worker_rows = None
+
+
+def _init_worker(template, rows):
+    global _worker_template, _worker_rows
+    _worker_template = template
+    _worker_rows = rows
+
+
+def _render_night(job):
+    date_text, activity, filename = job
+    return _worker_template.render(date_text, activity, _worker_rows, filename)
+
 
+# The table columns for the name, contact person and contact number.
+SLOT_COLUMNS = (1, 4, 5)
 
 def ensureExtension(filename, extension):
     return filename if filename.lower().endswith(extension) else filename + extension
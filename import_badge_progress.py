@@ -0,0 +1,259 @@
+'''
+This script writes badge progress recorded in a CSV file (e.g. from a camp) back to OSM.
+
+The CSV file needs member, badge, part and value columns. Members can be given by their
+id or full name, badges by their name or identifier and parts by their name or field.
+Only values that differ from what is already in OSM are sent, so an import that stopped
+part way through can be run again. Blank values are skipped rather than clearing the part.
+
+Usage: import_badge_progress.py <term> <section> <csv file> [--dry-run]
+'''
+
+import csv
+import random
+import sys
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from osm import RETRY_ATTEMPTS, RETRY_DELAY, RETRY_MAX_DELAY, Connection, Error, Manager, retryable
+
+# Number of updates to send at the same time.
+UPLOAD_WORKERS = 4
+
+# The most updates to start each second.
+UPLOAD_RATE = 5.0
+
+COLUMNS = ('member', 'badge', 'part', 'value')
+
+Change = namedtuple('Change', ['row', 'person', 'badge', 'part', 'old', 'new'])
+
+
+class ProgressImport(object):
+
+    def __init__(self):
+        self._conn = None
+        self._mgr = None
+        self._section = None
+        self._term = None
+
+    def _connect(self):
+        self._conn = Connection('secret.json')
+        self._conn.connect()
+
+    def _initialise(self):
+        self._mgr = Manager()
+        self._mgr.load(self._conn)
+
+    def run(self):
+        dry_run = '--dry-run' in sys.argv
+        args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+        if len(args) < 3:
+            print('ERROR: term, section and CSV file have not been set! ')
+            return
+
+        # No journal: the progress must be current for the comparison to be right.
+        print('Connecting to OSM...')
+        self._connect()
+        self._initialise()
+
+        self._set_term(args[0:2])
+        if self._term is None:
+            return
+
+        print('Reading %s...' % (args[2], ))
+        try:
+            rows = self._read_rows(args[2])
+        except (IOError, Error) as e:
+            print('ERROR: %s' % (e, ))
+            return
+
+        print('Retrieving badges...')
+        self._term.load_badges(self._conn)
+        errors = []
+        rows = self._resolve_badges(rows, errors)
+        self._term.load_progress(self._conn, list(set(badge for _, badge in rows)))
+
+        print('Comparing with OSM...')
+        changes, unchanged = self._find_changes(rows, errors)
+        for row, message in sorted(errors):
+            print('-> Row %d: %s' % (row, message))
+        print('-> %d changes, %d already in OSM, %d rows with errors' %
+              (len(changes), unchanged, len(set(row for row, _ in errors))))
+
+        if dry_run:
+            for change in changes:
+                print('-> Row %d: %s' % (change.row, describe(change)))
+            print('Dry run: nothing was sent')
+            return
+
+        if len(changes) > 0:
+            print('Sending %d changes...' % (len(changes), ))
+            self._send_changes(changes)
+        print('Done')
+
+    def _read_rows(self, filename):
+        ''' Reads the rows of the CSV file, numbered as they appear in a spreadsheet. '''
+        with open(filename) as csvfile:
+            reader = csv.DictReader(csvfile)
+            if reader.fieldnames is None:
+                raise Error('%s is empty' % (filename, ))
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+            missing = [column for column in COLUMNS if not column in reader.fieldnames]
+            if len(missing) > 0:
+                raise Error('%s is missing the %s column(s)' % (filename, ', '.join(missing)))
+            rows = []
+            for number, data in enumerate(reader, 2):
+                row = dict((column, (data[column] or '').strip()) for column in COLUMNS)
+                row['row'] = number
+                rows.append(row)
+        return rows
+
+    def _resolve_badges(self, rows, errors):
+        ''' Matches each row to a badge, dropping blank rows and rows whose badge cannot be found. '''
+        badges = lookup(self._term.badges, lambda badge: [badge.badge_id, badge.name])
+        resolved = []
+        for row in rows:
+            if row['value'] == '':
+                continue
+            badge = find(badges, row['badge'], 'badge', row, errors)
+            if not badge is None:
+                resolved.append((row, badge))
+        return resolved
+
+    def _find_changes(self, rows, errors):
+        ''' Compares the rows with the loaded progress, keeping only the values that differ. '''
+        people, parts = {}, {}
+        for badge in set(badge for _, badge in rows):
+            people[badge.badge_id] = lookup(badge.progress, lambda person: [
+                person.member_id, '%s %s' % (person.firstname, person.lastname)])
+            parts[badge.badge_id] = lookup(badge.parts, lambda part: [part.part_id, part.name])
+
+        changes = {}
+        seen = {}
+        unchanged = 0
+        for row, badge in rows:
+            person = find(people[badge.badge_id], row['member'], 'member', row, errors)
+            part = find(parts[badge.badge_id], row['part'], 'part of ' + badge.name, row, errors)
+            if person is None or part is None:
+                continue
+
+            key = (str(person.member_id), badge.badge_id, part.part_id)
+            if key in seen:
+                if seen[key]['value'] != row['value']:
+                    errors.append((row['row'], 'conflicts with row %d' % (seen[key]['row'], )))
+                continue
+            seen[key] = row
+            old = person.parts.get(part.part_id, '')
+            if old != row['value']:
+                changes[key] = Change(row['row'], person, badge, part, old, row['value'])
+            else:
+                unchanged += 1
+        return sorted(changes.values(), key=lambda change: change.row), unchanged
+
+    def _send_changes(self, changes):
+        limiter = RateLimiter(UPLOAD_RATE)
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            results = list(executor.map(lambda change: self._send_change(change, limiter), changes))
+        failed = 0
+        for change, error in zip(changes, results):
+            if not error is None:
+                failed += 1
+                print('-> Row %d: failed (%s): %s' % (change.row, error, describe(change)))
+        print('-> %d sent, %d failed' % (len(changes) - failed, failed))
+        if failed > 0:
+            print('-> Run the import again to retry the failed rows')
+
+    def _send_change(self, change, limiter):
+        ''' Sends one change, retrying network and server failures with backoff. Returns the error, if any. '''
+        attempt = 0
+        while True:
+            limiter.wait()
+            try:
+                change.badge.update_progress(self._conn, change.person.member_id,
+                                             change.part.part_id, change.new)
+                return None
+            except Error as e:
+                return str(e)
+            except (requests.RequestException, ValueError) as e:
+                attempt += 1
+                if attempt >= RETRY_ATTEMPTS or not retryable(e):
+                    return str(e)
+                time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt)))
+
+    def _set_term(self, args):
+        term_name = args[0]
+        self._set_section(args[1:])
+        if self._section is None:
+            return
+
+        print('Setting term...')
+        if term_name == 'current':
+            term = self._section.current_term()
+            if term is None:
+                print('-> Currently not in a term')
+                return
+            else:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        for term in self._section.terms:
+            if term.name == term_name:
+                self._term = term
+                print('-> Term set to %s' % (str(term), ))
+                return
+
+        print('-> Unknown term: %s' % (term_name, ))
+
+    def _set_section(self, args):
+        print('Setting section...')
+        section = self._mgr.find_section(args[0])
+        if section is None:
+            print('-> Unknown section: %s' % (args[0], ))
+        else:
+            self._section = section
+            print('-> Section set to %s' % (str(section), ))
+
+
+class RateLimiter(object):
+    ''' Spaces out calls from any number of threads so no more than rate start each second. '''
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def lookup(items, names):
+    ''' Indexes items by each of their (lower case) names; a name shared by several items maps to all of them. '''
+    index = {}
+    for item in items:
+        for name in set(str(name).strip().lower() for name in names(item)):
+            index.setdefault(name, []).append(item)
+    return index
+
+def find(index, name, kind, row, errors):
+    matches = index.get(name.lower(), [])
+    if len(matches) == 1:
+        return matches[0]
+    errors.append((row['row'], '%s %s: %s' % ('ambiguous' if len(matches) > 1 else 'unknown', kind, name)))
+    return None
+
+def describe(change):
+    return '%s %s, %s, %s: "%s" -> "%s"' % (change.person.firstname, change.person.lastname,
+                                           change.badge.name, change.part.name, change.old, change.new)
+
+if __name__ == "__main__":
+    mgr = ProgressImport()
+    mgr.run()
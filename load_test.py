@@ -0,0 +1,162 @@
+'''
+This script measures how loading from OSM scales with the number of download workers and sections.
+
+It serves a synthetic dataset (see osm_fixtures.py) from a local server with a simulated
+response time, then loads every section through a real Connection for each combination of
+workers and sections, and prints the throughput, request latencies and time per section.
+
+Usage: load_test.py [latency ms] [workers, e.g. 1,2,4,8] [sections, e.g. 1,2,4] [hedge ms]
+'''
+
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import osm
+from osm import Connection, Manager
+from osm_fixtures import Dataset
+
+# The size of each section.
+MEMBERS = 30
+BADGES = 60
+
+# The share of responses that take SLOW_FACTOR times longer than usual.
+SLOW_SHARE = 0.05
+SLOW_FACTOR = 10
+
+
+class TimedConnection(Connection):
+    ''' A connection that records how long each request takes. '''
+
+    def __init__(self, settings_path):
+        super(TimedConnection, self).__init__(settings_path)
+        self.latencies = []
+        self._timing_lock = threading.Lock()
+
+    def _post(self, url, data):
+        start = time.time()
+        resp = super(TimedConnection, self)._post(url, data)
+        with self._timing_lock:
+            self.latencies.append(time.time() - start)
+        return resp
+
+
+class LoadTest(object):
+
+    def __init__(self):
+        self._folder = None
+
+    def run(self):
+        latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05
+        workers = [int(value) for value in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8, 16]
+        sections = [int(value) for value in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1, 2, 4]
+        hedge = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else None
+
+        print('Starting server with %dms latency...' % (latency * 1000, ))
+        self._folder = tempfile.mkdtemp()
+        try:
+            for section_count in sections:
+                self._sweep(section_count, workers, latency, hedge)
+        finally:
+            shutil.rmtree(self._folder)
+        print('Done')
+
+    def _sweep(self, section_count, workers, latency, hedge):
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve, args=(section_count, latency, ready))
+        server.daemon = True
+        server.start()
+        try:
+            settings_path = os.path.join(self._folder, 'secret.json')
+            with open(settings_path, 'w') as f:
+                json.dump({'server': 'http://127.0.0.1:%d' % (ready.get(), ), 'token': 'test',
+                           'apiID': 'test', 'userName': 'test', 'password': 'test'}, f)
+
+            print('Sections: %d' % (section_count, ))
+            print('-> %7s %8s %7s %8s %7s %7s %7s %16s' %
+                  ('workers', 'requests', 'shared', 'req/s', 'p50', 'p95', 'p99', 'section mean/max'))
+            for worker_count in workers:
+                osm.DOWNLOAD_WORKERS = worker_count
+                conn = TimedConnection(settings_path)
+                conn.hedge_after = hedge
+                conn.connect()
+                self._measure(conn, worker_count)
+        finally:
+            server.terminate()
+            server.join()
+
+    def _measure(self, conn, worker_count):
+        conn.latencies = []
+        start = time.time()
+        mgr = Manager()
+        mgr.load(conn)
+        with ThreadPoolExecutor(max_workers=len(mgr.sections)) as executor:
+            times = list(executor.map(lambda section: load_section(section, conn), mgr.sections))
+        elapsed = time.time() - start
+
+        latencies = sorted(conn.latencies)
+        print('-> %7d %8d %7d %8.1f %6.0fms %6.0fms %6.0fms %7.2fs/%.2fs' %
+              (worker_count, len(latencies), conn.in_flight.coalesced, len(latencies) / elapsed,
+               percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+               percentile(latencies, 99) * 1000, sum(times) / len(times), max(times)))
+
+
+def load_section(section, conn):
+    ''' Loads everything the reports use for the last term of a section; returns the time taken. '''
+    start = time.time()
+    term = section.terms[-1]
+    term.load_members(conn, True)
+    term.load_badges(conn)
+    term.load_progress(conn)
+    term.load_badges_by_person(conn)
+    term.load_programme(conn, True)
+    return time.time() - start
+
+def percentile(values, percent):
+    ''' The nearest-rank percentile of some sorted values. '''
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def serve(section_count, latency, ready):
+    ''' Serves a dataset until the process is stopped, sending the port to the ready queue. '''
+    dataset = Dataset(sections=section_count, members=MEMBERS, badges=BADGES)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            data = dict(parse_qsl(self.rfile.read(length).decode('utf-8')))
+            delay = latency * (SLOW_FACTOR if random.random() < SLOW_SHARE else 1)
+            time.sleep(random.uniform(0.5, 1.5) * delay)
+            body = json.dumps(dataset.response(self.path, data)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    mgr = LoadTest()
+    mgr.run()
@@ -0,0 +1,90 @@
+''' Opt-in memory profiling for the report generators.
+
+    Set OSM_MEMORY_PROFILE=1 to print the memory used after each stage of a run and the
+    top allocation sites at the end; a larger number sets how many sites are listed. '''
+
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_VARIABLE = 'OSM_MEMORY_PROFILE'
+TOP_SITES = 10
+
+MB = 1024.0 * 1024.0
+
+
+class MemoryProfile(object):
+    ''' Takes tracemalloc snapshots at stage boundaries. '''
+
+    def __init__(self):
+        value = os.environ.get(PROFILE_VARIABLE, '')
+        self.enabled = not value in ('', '0')
+        self.top = int(value) if value.isdigit() and int(value) > 1 else TOP_SITES
+        self.stages = []
+        self._previous = None
+        self._largest = None
+        if self.enabled:
+            tracemalloc.start()
+
+    def checkpoint(self, stage):
+        ''' Records the memory in use now and the peak since the last checkpoint. '''
+        if not self.enabled:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ])
+        rss = peak_rss()
+        self.stages.append((stage, current, peak, rss))
+        print('-> Memory after %s: %.1f MB (stage peak %.1f MB, peak RSS %s)' %
+              (stage, current / MB, peak / MB, 'unknown' if rss is None else '%.1f MB' % (rss / MB, )))
+        if not self._previous is None:
+            for stat in snapshot.compare_to(self._previous, 'lineno')[:3]:
+                if stat.size_diff > 0:
+                    print('   +%.1f MB %s' % (stat.size_diff / MB, _site(stat.traceback)))
+
+        self._previous = snapshot
+        if self._largest is None or current >= self._largest[0]:
+            self._largest = (current, stage, snapshot)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def report(self):
+        ''' Prints the stages and the top allocation sites when memory use was highest, then stops tracing. '''
+        if not self.enabled:
+            return
+        print('Memory profile:')
+        print('-> %-24s %10s %12s %10s' % ('Stage', 'In use', 'Stage peak', 'Peak RSS'))
+        for stage, current, peak, rss in self.stages:
+            print('-> %-24s %7.1f MB %9.1f MB %10s' % (stage, current / MB, peak / MB,
+                                                       '' if rss is None else '%.1f MB' % (rss / MB, )))
+        if not self._largest is None:
+            print('Top allocation sites after %s:' % (self._largest[1], ))
+            for stat in self._largest[2].statistics('lineno')[:self.top]:
+                print('-> %7.1f MB %8d blocks  %s' % (stat.size / MB, stat.count, _site(stat.traceback)))
+        tracemalloc.stop()
+        self._previous = self._largest = None
+
+
+def peak_rss():
+    ''' The peak resident set size of the process in bytes, if the platform reports it. '''
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return usage if os.uname()[0] == 'Darwin' else usage * 1024
+
+def _site(traceback):
+    ''' The file (relative to where it was imported from) and line of an allocation. '''
+    frame = traceback[0]
+    filename = frame.filename
+    prefixes = [path for path in sys.path if path and filename.startswith(os.path.join(path, ''))]
+    if len(prefixes) > 0:
+        filename = filename[len(os.path.join(max(prefixes, key=len), '')):]
+    return '%s:%d' % (filename, frame.lineno)
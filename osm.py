@@ -1,11 +1,62 @@
 ''' Objects for working with OSM data. '''
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 import csv
 import json
+import os
+import random
+import re
+import threading
+import time
 import requests
 import xlsxwriter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Number of downloads to run at the same time.
+DOWNLOAD_WORKERS = 8
+
+# The badge types: challenge, activity, staged and core.
+BADGE_TYPES = (1, 2, 3, 4)
+
+# Retry settings for read-only fetches: the delay before each retry is a random
+# time up to RETRY_DELAY * 2^attempt seconds, capped at RETRY_MAX_DELAY.
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Journals older than this (in seconds) are from an abandoned run and are ignored.
+JOURNAL_MAX_AGE = 12 * 60 * 60
+
+# Timeouts in seconds as (connect, read), matched on the start of the URL; the
+# longest match wins. Badge records and the member grid are slow for big sections.
+TIMEOUTS = {
+    '/ext/badges/records/?action=getBadgeRecords': (10, 90),
+    '/ext/members/contact/grid/': (10, 60),
+}
+DEFAULT_TIMEOUT = (10, 30)
+
+# JSON decoders that work on the raw response bytes, fastest first; only installed ones are listed.
+JSON_DECODERS = []
+if not orjson is None:
+    JSON_DECODERS.append(('orjson', orjson.loads))
+if not ujson is None:
+    JSON_DECODERS.append(('ujson', ujson.loads))
+JSON_DECODERS.append(('json', lambda content: json.loads(content.decode('utf-8'))))
+
+# Phrases in OSM's errors when the user id/secret pair is no longer accepted. Other
+# errors (such as no access to a section) are left alone, as logging in again will not help.
+AUTH_ERRORS = ('secret', 'userid', 'user id', 'not logged in')
+
 
 class Connection(object):
     ''' Connection to OSM. '''
@@ -18,58 +69,370 @@ class Connection(object):
             self._api_id = settings['apiID']
             self._username = settings['userName']
             self._password = settings['password']
-        self._user_id = None
-        self._secret = None
+        self._credentials_path = os.path.join(
+            os.path.dirname(settings_path), 'credentials.json')
+        # The user id and secret are swapped together as one tuple so threads never see half a login.
+        self._credentials = (None, None)
+        self._auth_lock = threading.Lock()
+        self._local = threading.local()
+        self._hedges = None
+        self._hedge_lock = threading.Lock()
+        self.timeouts = dict(TIMEOUTS)
+        self.timeouts.update(dict((key, tuple(value)) for key, value in settings.get('timeouts', {}).items()))
+        self.hedge_after = settings.get('hedgeAfter')
+        self.decoder, self.decode = json_decoder(settings.get('jsonDecoder'))
+        # Opt-in: saves the raw body of every response (e.g. for benchmark_json.py).
+        record_path = settings.get('recordResponses')
+        self.recorder = None if record_path is None else ResponseRecorder(record_path)
+        self.in_flight = SingleFlight()
+        self.journal = None
 
     def connect(self):
-        ''' Connects to the server. '''
+        ''' Connects to the server, reusing any cached credentials. '''
+        if not self._load_credentials():
+            self._authorise()
+
+    def _authorise(self):
+        ''' Authorises the user and caches the returned credentials. '''
         data = {
             'token': self._token,
             'apiid': self._api_id,
             'email': self._username,
             'password': self._password
         }
-        req = requests.post(
-            self._server + '/users.php?action=authorise', data=data)
-        resp = req.json()
+        url = '/users.php?action=authorise'
+        req = self._session().post(self._server + url, data=data, timeout=self._timeout(url))
+        resp = self.decode(req.content)
         try:
-            self._user_id = resp['userid']
-            self._secret = resp['secret']
+            self._credentials = (resp['userid'], resp['secret'])
         except KeyError:
             raise Error('Unable to connect: ' + resp['error'])
+        self._save_credentials()
 
-    def download(self, url):
-        ''' Downloads some data from the server. '''
+    def _reauthorise(self, expired):
+        ''' Authorises again unless another thread has already replaced the expired credentials. '''
+        with self._auth_lock:
+            if self._credentials is expired:
+                self._authorise()
+            return self._credentials
+
+    def _load_credentials(self):
+        ''' Loads the cached credentials if they belong to this user. '''
+        try:
+            with open(self._credentials_path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if cached.get('server') != self._server or cached.get('userName') != self._username:
+            return False
+        self._credentials = (cached['userid'], cached['secret'])
+        return True
+
+    def _save_credentials(self):
+        ''' Saves the credentials so only the owner can read them. '''
         data = {
-            'token': self._token,
-            'apiid': self._api_id,
-            'userid': self._user_id,
-            'secret': self._secret
+            'server': self._server,
+            'userName': self._username,
+            'userid': self._credentials[0],
+            'secret': self._credentials[1]
         }
-        req = requests.post(self._server + url, data=data)
+        write_json(self._credentials_path, data, 0o600)
+
+    def _session(self):
+        ''' Gets the session for this thread, so each thread keeps its own connections open. '''
+        try:
+            return self._local.session
+        except AttributeError:
+            self._local.session = requests.Session()
+            return self._local.session
+
+    def _timeout(self, url):
+        best = None
+        for prefix in self.timeouts:
+            if url.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return DEFAULT_TIMEOUT if best is None else self.timeouts[best]
+
+    def _post(self, url, data):
+        ''' Posts to the server, re-authorising once if the credentials have expired.
+            Returns the decoded response, or None if it was empty; raises Error if the
+            request is still rejected with new credentials. '''
+        credentials = self._credentials
+        req, resp, error = self._send_and_decode(url, data, credentials)
+        if self._is_unauthorised(req, resp):
+            credentials = self._reauthorise(credentials)
+            req, resp, error = self._send_and_decode(url, data, credentials)
+            if self._is_unauthorised(req, resp):
+                # Fresh credentials were rejected too, so logging in again will not help.
+                raise Error('Not authorised for %s: %s' % (url.split('?')[0], _error_message(req, resp)))
         req.raise_for_status()
-        return req.json()
+        if not error is None:
+            raise error
+        return resp
+
+    def _send_and_decode(self, url, data, credentials):
+        ''' Sends a request and decodes the body once, keeping any decoding error to raise later. '''
+        req = self._send(url, data, credentials)
+        if len(req.content) == 0:
+            return req, None, None
+        if not self.recorder is None:
+            self.recorder.record(url, req.content)
+        try:
+            return req, self.decode(req.content), None
+        except ValueError as e:
+            return req, None, e
 
-    def upload(self, url, data):
-        ''' Downloads some data from the server. '''
+    def _send(self, url, data, credentials):
+        data = dict(data)
         data['token'] = self._token
         data['apiid'] = self._api_id
-        data['userid'] = self._user_id
-        data['secret'] = self._secret
-        req = requests.post(self._server + url, data=data)
-        req.raise_for_status()
-        if req.text != '':
-            return req.json()
-        return {}
+        data['userid'] = credentials[0]
+        data['secret'] = credentials[1]
+        return self._session().post(self._server + url, data=data, timeout=self._timeout(url))
+
+    def _is_unauthorised(self, req, resp):
+        if req.status_code in (401, 403):
+            return True
+        if not isinstance(resp, dict) or not 'error' in resp:
+            return False
+        message = str(resp['error']).lower()
+        return any(phrase in message for phrase in AUTH_ERRORS)
+
+    def fetch(self, url, data=None):
+        ''' Fetches read-only data from the server.
+            Responses already in the journal are reused, identical fetches that are already
+            running are shared (so callers must not change the response), and failures are
+            retried with backoff. '''
+        key = url
+        if not data is None:
+            key += ' ' + json.dumps(data, sort_keys=True)
+        if not self.journal is None and key in self.journal:
+            return self.journal.get(key)
+        return self.in_flight.do(key, lambda: self._fetch(key, url, data))
+
+    def _fetch(self, key, url, data):
+        attempt = 0
+        while True:
+            try:
+                resp = self._hedged(url, data)
+                break
+            except (requests.RequestException, ValueError) as e:
+                attempt += 1
+                if attempt >= RETRY_ATTEMPTS or not retryable(e):
+                    raise
+                time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt)))
+
+        if not self.journal is None:
+            self.journal.record(key, resp)
+        return resp
+
+    def _hedged(self, url, data):
+        ''' Sends a read-only request; if hedge_after is set and no answer has come back by
+            then, a second copy is sent and whichever answers first is used. '''
+        send = lambda: self.download(url) if data is None else self.upload(url, data)
+        if self.hedge_after is None:
+            return send()
+
+        with self._hedge_lock:
+            if self._hedges is None:
+                self._hedges = ThreadPoolExecutor(max_workers=2 * DOWNLOAD_WORKERS)
+        started = threading.Event()
+
+        def send_first():
+            started.set()
+            return send()
+
+        first = self._hedges.submit(send_first)
+        # Time the request from when it starts, not from when it was queued for a thread.
+        started.wait()
+        done, _ = wait([first], timeout=self.hedge_after)
+        if len(done) > 0:
+            return first.result()
+
+        second = self._hedges.submit(send)
+        error = None
+        for future in as_completed([first, second]):
+            try:
+                resp = future.result()
+            except (requests.RequestException, ValueError) as e:
+                error = e
+                continue
+            # Drop the copy if it is still waiting for a thread.
+            second.cancel()
+            return resp
+        raise error
+
+    def download(self, url):
+        ''' Downloads some data from the server. '''
+        resp = self._post(url, {})
+        if resp is None:
+            raise ValueError('Empty response from %s' % (url, ))
+        return resp
+
+    def upload(self, url, data):
+        ''' Uploads some data to the server. '''
+        resp = self._post(url, data)
+        if resp is None:
+            return {}
+        return resp
 
     def download_binary(self, url, filename):
         ''' Downloads a binary file from the server'''
         url = url if url.startswith('/') else u'/' + url
-        req = requests.get(self._server + str(url))
+        req = self._session().get(self._server + str(url), timeout=self._timeout(url))
         with open(filename, 'wb') as f:
             f.write(req.content)
 
 
+def endpoint(url):
+    ''' The OSM endpoint a request was for, e.g. "records/getBadgeRecords". '''
+    path = url.split('?')[0].rstrip('/').split('/')[-1]
+    match = re.search(r'action=(\w+)', url)
+    return path if match is None else path + '/' + match.group(1)
+
+def _error_message(req, resp):
+    if isinstance(resp, dict) and 'error' in resp:
+        return str(resp['error'])
+    return 'HTTP %d' % (req.status_code, )
+
+def retryable(error):
+    ''' Checks whether a failed request is worth sending again: connection errors, timeouts,
+        server (5xx) errors and garbled responses are, other (4xx) errors are not. '''
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, (requests.RequestException, ValueError))
+
+def json_decoder(name=None):
+    ''' Gets the (name, decode function) of a JSON decoder, or of the fastest installed one. '''
+    for decoder in JSON_DECODERS:
+        if name is None or decoder[0] == name:
+            return decoder
+    raise Error('JSON decoder is not installed: %s' % (name, ))
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def write_json(path, data, mode=0o644):
+    ''' Writes a JSON file atomically with the given permissions. '''
+    temp_path = path + '.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.chmod(temp_path, mode)
+    _replace(temp_path, path)
+
+
+class SingleFlight(object):
+    ''' Runs one call per key at a time: callers asking for a key that is already being
+        called wait for that call and get the same result (or error). '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, call):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(call())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+
+class Journal(object):
+    ''' An append-only record of completed fetches, so an interrupted run can resume where it stopped. '''
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) > JOURNAL_MAX_AGE:
+            os.remove(path)
+        valid = 0
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    # Stop at the first line a crash left unfinished.
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('Unfinished line')
+                        entry = json.loads(line.decode('utf-8'))
+                        self._entries[entry['key']] = entry['data']
+                    except (ValueError, KeyError, TypeError):
+                        break
+                    valid += len(line)
+        except IOError:
+            pass
+        self._file = open(path, 'a')
+        # Drop anything after the last complete record so new records start on a line of their own.
+        self._file.truncate(valid)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        ''' Gets the recorded response for a fetch. '''
+        return self._entries[key]
+
+    def record(self, key, data):
+        ''' Records a completed fetch. '''
+        line = json.dumps({'key': key, 'data': data}) + '\n'
+        with self._lock:
+            self._entries[key] = data
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def finish(self):
+        ''' Removes the journal once the run has completed. '''
+        self._file.close()
+        os.remove(self._path)
+
+
+class ResponseRecorder(object):
+    ''' Saves the raw body of each response, one file per response in a folder per endpoint.
+        The bodies hold member details, so only the owner can read them. '''
+
+    def __init__(self, path):
+        self._path = path
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, content):
+        name = endpoint(url)
+        folder = os.path.join(self._path, *name.split('/'))
+        with self._lock:
+            number = self._counts.get(name, 0) + 1
+            self._counts[name] = number
+            if number == 1 and not os.path.isdir(folder):
+                os.makedirs(folder, 0o700)
+        filename = os.path.join(folder, '%s-%05d.json' % (datetime.now().strftime('%Y%m%d%H%M%S'), number))
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+
+
 class Error(Exception):
     ''' Connection errors. '''
 
@@ -86,17 +449,18 @@ class Manager(object):
 
     def __init__(self):
         self.sections = []
+        self.badge_cache = BadgeCache()
 
     def load(self, conn):
         ''' Loads the data for a manager. '''
-        data = conn.download('/api.php?action=getUserRoles')
+        data = conn.fetch('/api.php?action=getUserRoles')
         sections = {}
         for rec in data:
-            section = Section(rec)
+            section = Section(rec, self.badge_cache)
             sections[section.section_id] = section
             self.sections.append(section)
 
-        data = conn.download('/api.php?action=getTerms')
+        data = conn.fetch('/api.php?action=getTerms')
         for key, value in data.items():
             section = sections[key]
             for rec in value:
@@ -121,13 +485,14 @@ class Manager(object):
 class Section(object):
     ''' A scouting section. '''
 
-    def __init__(self, source):
+    def __init__(self, source, badge_cache=None):
         self.name = source["sectionname"]
         self.type = source["section"]
         self.group = source["groupname"]
         self.section_id = source["sectionid"]
         self.terms = []
         self.badges = []
+        self.badge_cache = BadgeCache() if badge_cache is None else badge_cache
 
     def __str__(self):
         return '%s: %s [%s]' % (self.group, self.name, self.type)
@@ -163,15 +528,20 @@ class Term(object):
         return '%s (%s to %s)' % (self.name, start_date, end_date)
 
     def load_badges(self, conn):
-        '''Retrieves the badges for the term. '''
+        '''Retrieves the badges of every type for the term.
+           The badge structures are shared with the section's other terms. '''
+        cache = self.section.badge_cache
+        with ThreadPoolExecutor(max_workers=len(BADGE_TYPES)) as executor:
+            types = list(executor.map(lambda badge_type: cache.load_type(conn, self, badge_type), BADGE_TYPES))
         self.badges = []
-        self.__load_badges(conn, 1)
-        self.__load_badges(conn, 2)
+        for badges in types:
+            for details, parts in badges:
+                self.badges.append(Badge(len(self.badges) + 1, details, None, self, parts))
         self.badges_loaded = True
 
     def load_badges_by_person(self, conn):
         '''Retrieves the badges for the members for the term. '''
-        data = conn.download('/ext/badges/badgesbyperson/?action=loadBadgesByMember&sectionid=%s&term_id=%s' %
+        data = conn.fetch('/ext/badges/badgesbyperson/?action=loadBadgesByMember&sectionid=%s&term_id=%s' %
                              (self.section.section_id, self.term_id))
         badge_report = []
         for rec in data['data']:
@@ -179,24 +549,14 @@ class Term(object):
             badge_report.append(member)
         return badge_report
 
-    def __load_badges(self, conn, badge_type):
-        '''Retrieves the badges for the term. '''
-        number = len(self.badges) + 1
-        data = conn.download(
-            '/ext/badges/records/?action=getBadgeStructureByType' +
-            '&a=1&section=%s&type_id=%s&term_id=%s&section_id=%s' %
-            (self.section.type, badge_type, self.term_id, self.section.section_id))
-        details = data['details']
-        structure = data['structure']
-        for _, value in details.items():
-            badge_id = value['badge_identifier']
-            try:
-                parts = structure[badge_id]
-            except KeyError:
-                parts = [{}, {}]
-            badge = Badge(number, value, parts, self)
-            self.badges.append(badge)
-            number += 1
+    def load_progress(self, conn, badges=None):
+        ''' Loads the progress for several badges concurrently. '''
+        if badges is None:
+            badges = self.badges
+        pending = [badge for badge in badges if not badge.progress_loaded]
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            list(executor.map(lambda badge: badge.load_progress(conn), pending))
+        return badges
 
     def find_badge(self, name):
         ''' Finds a badge by its name. '''
@@ -208,7 +568,7 @@ class Term(object):
 
     def load_programme(self, conn, include_attendance=False):
         ''' Loads the programme for the term. '''
-        data = conn.download('/ext/programme/?action=getProgrammeSummary&sectionid=%s&termid=%s' %
+        data = conn.fetch('/ext/programme/?action=getProgrammeSummary&sectionid=%s&termid=%s' %
                              (self.section.section_id, self.term_id))
         self.programme = []
         for rec in data['items']:
@@ -219,7 +579,7 @@ class Term(object):
         if include_attendance:
             meetings = list([(meeting.date.strftime('%Y-%m-%d'), meeting)
                              for meeting in self.programme])
-            data = conn.download('/ext/members/attendance/?action=get&sectionid=%s&termid=%s' %
+            data = conn.fetch('/ext/members/attendance/?action=get&sectionid=%s&termid=%s' %
                                  (self.section.section_id, self.term_id))
             for rec in data['items']:
                 member = Member(rec)
@@ -239,7 +599,7 @@ class Term(object):
             'section_id': self.section.section_id,
             'term_id': self.term_id
         }
-        data = conn.upload(
+        data = conn.fetch(
             '/ext/members/contact/grid/?action=getMembers', data)
         self.members = []
 
@@ -302,10 +662,65 @@ class Term(object):
                     meeting.save(conn)
 
 
+class BadgeCache(object):
+    ''' Badge structures shared by the terms (and sections) of a manager.
+
+        Each term's badges of a type are downloaded once (the listing is asked for
+        by term, as the badges on offer can change between terms), and the parts of
+        each badge are parsed once, keyed by badge identifier (id and version). '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._parts = {}
+
+    def load_type(self, conn, term, badge_type):
+        ''' Gets the (details, parts) of the term's badges of a type. '''
+        key = (term.section.section_id, term.term_id, badge_type)
+        with self._lock:
+            if key in self._types:
+                return self._types[key]
+
+        data = conn.fetch(
+            '/ext/badges/records/?action=getBadgeStructureByType' +
+            '&a=1&section=%s&type_id=%s&term_id=%s&section_id=%s' %
+            (term.section.type, badge_type, term.term_id, term.section.section_id))
+        # OSM sends an empty list (or an error) rather than an empty object when there are no badges.
+        details = data.get('details') if isinstance(data, dict) else None
+        structure = data.get('structure') if isinstance(data, dict) else None
+        if not isinstance(details, dict):
+            details = {}
+        if not isinstance(structure, dict):
+            structure = {}
+        badges = [(value, self._get_parts(value['badge_identifier'], structure))
+                  for _, value in details.items()]
+        with self._lock:
+            self._types[key] = badges
+        return badges
+
+    def _get_parts(self, badge_id, structure):
+        with self._lock:
+            if badge_id in self._parts:
+                return self._parts[badge_id]
+        try:
+            rows = structure[badge_id][1]['rows']
+        except (KeyError, IndexError):
+            rows = []
+        parts = list([BadgePart(part) for part in rows])
+        with self._lock:
+            return self._parts.setdefault(badge_id, parts)
+
+    def clear(self):
+        ''' Forgets the cached structures so they are downloaded again. '''
+        with self._lock:
+            self._types = {}
+            self._parts = {}
+
+
 class Badge(object):
     ''' Defines a badge. '''
 
-    def __init__(self, number, details, structure, term):
+    def __init__(self, number, details, structure, term, parts=None):
         self.number = number
         self.term = term
         self.section = term.section
@@ -317,11 +732,12 @@ class Badge(object):
         self.picture = details['picture']
         self.progress = []
         self.progress_loaded = False
-        try:
-            parts = structure[1]['rows']
-        except (KeyError, IndexError):
-            parts = []
-        self.parts = list([BadgePart(part) for part in parts])
+        if parts is None:
+            try:
+                parts = list([BadgePart(part) for part in structure[1]['rows']])
+            except (KeyError, IndexError):
+                parts = []
+        self.parts = parts
 
     def __str__(self):
         badge_type = self.type
@@ -334,7 +750,7 @@ class Badge(object):
     def load_progress(self, conn):
         ''' Loads the progress of the section for this badge. '''
         self.progress = []
-        data = conn.download(
+        data = conn.fetch(
             '/ext/badges/records/?action=getBadgeRecords' +
             '&term_id=%s&section=%s&badge_id=%s&section_id=%s&badge_version=%s' %
             (self.term.term_id, self.section.type, self.__id,
@@ -343,6 +759,25 @@ class Badge(object):
             self.progress.append(BadgeProgress(person, self))
         self.progress_loaded = True
 
+    def update_progress(self, conn, member_id, part_id, value):
+        ''' Sets one part of the badge for a member.
+            This sets rather than adds to the value, so it is safe to send again after a failure. '''
+        data = {
+            'scoutid': member_id,
+            'section_id': self.section.section_id,
+            'badge_id': self.__id,
+            'badge_version': self.__version,
+            'field': part_id,
+            'value': value
+        }
+        data = conn.upload('/ext/badges/records/?action=updateSingleRecord', data)
+        if isinstance(data, dict) and 'error' in data:
+            raise Error('Unable to update %s: %s' % (self.name, data['error']))
+        for person in self.progress:
+            if str(person.member_id) == str(member_id):
+                person.parts[part_id] = value
+        return data
+
     def export_progress(self, filename=None, workbook=None):
         ''' Exports the badge progress to an Excel file. '''
         close_workbook = False
@@ -590,6 +1025,42 @@ class AwardScheme(object):
             for badge in data['badges']:
                 self.badges.append(AwardSchemeBadge(badge))
 
+    def badge_identifiers(self):
+        ''' Gets the identifiers of the badges used by the scheme, each listed once. '''
+        identifiers = []
+        for badge in self.badges:
+            ids = [part.id for part in badge.parts]
+            if not badge.complete_id is None:
+                ids.insert(0, badge.complete_id)
+            for badge_id in ids:
+                if not badge_id in identifiers:
+                    identifiers.append(badge_id)
+        return identifiers
+
+    def link(self, badge_map):
+        ''' Points the scheme's badges and parts at the term's badges, keyed by identifier.
+            Returns the badges the scheme uses. '''
+        badges = dict((badge_id, badge_map[badge_id]) for badge_id in self.badge_identifiers())
+        for badge in self.badges:
+            if not badge.complete_id is None:
+                badge.badge = badges[badge.complete_id]
+            for part in badge.parts:
+                part.badge = badges[part.id]
+        return badges
+
+
+class FetchPlan(object):
+    ''' The badges an award scheme needs, fetched once each and shared by all the award parts. '''
+
+    def __init__(self, scheme, badge_map):
+        self.scheme = scheme
+        self.badges = scheme.link(badge_map)
+
+    def fetch(self, term, conn):
+        ''' Loads the progress of every planned badge concurrently. '''
+        term.load_progress(conn, list(self.badges.values()))
+        return self.badges
+
 
 class AwardSchemeBadge(object):
 
@@ -633,6 +1104,7 @@ class CustomColumn(object):
 class BadgeOrder(object):
     def __init__(self, badges_path):
         self._badges = {}
+        self._dirty = False
         try:
             with open(badges_path, 'r+') as f:
                 data = json.load(f)
@@ -641,33 +1113,51 @@ class BadgeOrder(object):
             
         if 'badges' in data:
             self._badges = { b['id'] : b for b in data['badges'] }
+        self._ranks = { id : b['order'] for id, b in self._badges.items() }
+        self._remove_with = { id : b['removeWith'] for id, b in self._badges.items() if 'removeWith' in b }
         
     def save(self, badges_path):
+        ''' Saves the order if any new badges have been added. '''
+        if not self._dirty:
+            return False
         badges = list(self._badges.values())
         badges.sort(key=self._sort_by_order)
         data = {
             'badges': badges
         }
-        with open(badges_path, 'w+') as f:
-            json.dump(data, f, indent=4)
+        write_json(badges_path, data)
+        self._dirty = False
+        return True
 
     def _sort_by_order(self, badge):
         return badge['order']
 
     def get_order(self, id, name):
         try:
-            return self._badges[id]['order']
+            return self._ranks[id]
         except KeyError:
-            new_order = len(self._badges) + 1
-            self._badges[id] = {
-                'id': id,
-                'name': name,
-                'order': new_order
-            }
-            return new_order
+            return self._add(id, name)
+
+    def _add(self, id, name):
+        new_order = len(self._badges) + 1
+        self._badges[id] = {
+            'id': id,
+            'name': name,
+            'order': new_order
+        }
+        self._ranks[id] = new_order
+        self._dirty = True
+        return new_order
+
+    def sort_badges(self, people):
+        ''' Sorts the badges of every person, adding new badges in the order they are first seen. '''
+        ranks = self._ranks
+        for person in people:
+            for badge in person.badges:
+                if not badge.badge_id in ranks:
+                    self._add(badge.badge_id, badge.name)
+        for person in people:
+            person.badges.sort(key=lambda badge: ranks[badge.badge_id])
 
     def remove_with(self, id):
-        try:
-            return self._badges[id]['removeWith']
-        except KeyError:
-            return ''
+        return self._remove_with.get(id, '')
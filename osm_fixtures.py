@@ -0,0 +1,461 @@
+'''
+Synthetic OSM data for stress tests.
+
+The responses have the same shapes as the OSM API, so the objects in osm.py can load
+them through FixtureConnection. The data is deterministic for a seed: every response
+is built from its own random generator, so the order of the requests does not matter.
+'''
+
+import json
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from datetime import date, timedelta
+import random
+
+from osm import Error, Manager, SingleFlight
+
+SECTION_TYPES = [('Keas', 'keas', (5, 8)), ('Cubs', 'cubs', (8, 11)),
+                 ('Scouts', 'scouts', (11, 15)), ('Venturers', 'venturers', (14, 18))]
+BADGE_TYPES = {1: 'Challenge', 2: 'Activity', 3: 'Staged', 4: 'Core'}
+FIRST_NAMES = ['Aria', 'Ben', 'Charlotte', 'Daniel', 'Ella', 'Finn', 'Grace', 'Hemi', 'Isla', 'Jack',
+               'Kahu', 'Lily', 'Mason', 'Nikau', 'Olivia', 'Piper', 'Quinn', 'Ruby', 'Sam', 'Tama',
+               'Una', 'Victor', 'Wiremu', 'Xavier', 'Yasmin', 'Zoe', 'Amelia', 'Leo', 'Mia', 'Oscar']
+LAST_NAMES = ['Anderson', 'Brown', 'Chen', 'Davies', 'Evans', 'Fraser', 'Green', 'Harris', 'Ikeda',
+              'Jones', 'King', 'Lee', 'Martin', 'Ngata', 'Patel', 'Robinson', 'Singh', 'Taylor',
+              'Walker', 'Wilson', 'Young', 'Parata', 'Thompson', 'Williams', 'Smith']
+BADGE_WORDS = ['Astronomy', 'Camping', 'Cooking', 'Cycling', 'First Aid', 'Fishing', 'Gardening',
+               'Hiking', 'Kayaking', 'Knots', 'Map Reading', 'Music', 'Photography', 'Science',
+               'Swimming', 'Tramping', 'Conservation', 'Community', 'Citizenship', 'Technology']
+CUSTOM_GROUPS = [('contact_primary_1', 1), ('contact_primary_2', 2), ('emergency', 3), ('doctor', 4)]
+CUSTOM_COLUMNS = [('first_name', 2), ('last_name', 3), ('mobile_phone', 4), ('home_phone', 5), ('email1', 12)]
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+# A 1x1 transparent PNG, used for every badge picture.
+PNG = (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 6, 0, 0, 0)) +
+       _png_chunk(b'IDAT', zlib.compress(b'\x00' * 5)) + _png_chunk(b'IEND', b''))
+
+
+class Dataset(object):
+    ''' A synthetic OSM account.
+
+        sections: the number of sections (Keas, Cubs, Scouts, Venturers, Cubs 2, ...).
+        terms: the number of terms in each section, starting from start_date.
+        members: the number of young people in each term; turnover of them are replaced each term.
+        badges: the number of badges, spread over the four badge types.
+        identifiers: badge identifiers (e.g. from an award scheme) that must exist; these are challenge badges. '''
+
+    def __init__(self, seed=1, sections=1, terms=4, members=30, badges=60, meetings=10,
+                 leaders=3, turnover=None, identifiers=None, start_date=date(2020, 2, 3)):
+        self.seed = seed
+        self.term_count = terms
+        self.member_count = members
+        self.meeting_count = meetings
+        self.leader_count = leaders
+        self.turnover = members // 4 if turnover is None else turnover
+        self.start_date = start_date
+        self.sections = [self._make_section(index) for index in range(sections)]
+        self.badges = self._make_badges(badges, identifiers or [])
+        self._plans = {}
+        # Badge parts set through updateSingleRecord, keyed by (section, badge, member).
+        self._updates = {}
+        self._lock = threading.Lock()
+
+    def _random(self, *key):
+        return random.Random('%s:%s' % (self.seed, ':'.join(str(part) for part in key)))
+
+    def _make_section(self, index):
+        name, section_type, ages = SECTION_TYPES[index % len(SECTION_TYPES)]
+        if index >= len(SECTION_TYPES):
+            name = '%s %d' % (name, index // len(SECTION_TYPES) + 1)
+        section = {
+            'index': index,
+            'name': name,
+            'type': section_type,
+            'id': str(10000 + index),
+            'terms': [],
+            'members': [],
+        }
+        for term in range(self.term_count):
+            start = self.start_date + timedelta(days=91 * term)
+            section['terms'].append({
+                'index': term,
+                'name': 'Term %d %d' % (term % 4 + 1, start.year),
+                'id': str(200000 + index * 1000 + term),
+                'start': start,
+                'end': start + timedelta(days=70),
+            })
+
+        pool = self.leader_count + self.member_count + self.turnover * (self.term_count - 1)
+        for number in range(pool):
+            rnd = self._random('member', index, number)
+            young = number - self.leader_count
+            if young < 0:
+                join, age = 0, rnd.randint(25, 60)
+            elif self.turnover == 0:
+                join, age = 0, rnd.randint(ages[0], ages[1] - 1)
+            else:
+                join = max(0, (young - self.member_count) // self.turnover + 1)
+                age = rnd.randint(ages[0], ages[1] - 1) - join // 4
+            born = self.start_date - timedelta(days=365 * age + rnd.randint(0, 364))
+            section['members'].append({
+                'id': str(1000000 + index * 10000 + number),
+                'first_name': rnd.choice(FIRST_NAMES),
+                'last_name': rnd.choice(LAST_NAMES),
+                'dob': born.strftime('%Y-%m-%d'),
+                'patrol': 'Leaders' if young < 0 else rnd.choice(['Red', 'Blue', 'Green', 'Yellow']),
+                'role': '' if young < 0 or rnd.random() < 0.8 else rnd.choice(['Sixer', 'Seconder']),
+                'keenness': rnd.uniform(0.1, 0.9),
+                'attendance': rnd.uniform(0.5, 1.0),
+                'join': join,
+            })
+        return section
+
+    def _make_badges(self, count, identifiers):
+        rnd = self._random('badges')
+        badges = []
+        field = 1000
+        for index in range(max(count, len(identifiers))):
+            if index < len(identifiers):
+                badge_id, version = identifiers[index].split('_')
+                badge_type = 1
+            else:
+                badge_id, version = str(5000 + index), str(rnd.randint(0, 2))
+                badge_type = index % len(BADGE_TYPES) + 1
+            name = '%s %d' % (BADGE_WORDS[index % len(BADGE_WORDS)], index // len(BADGE_WORDS) + 1)
+            parts = []
+            if rnd.random() < 0.3:
+                for group in range(rnd.randint(2, 4)):
+                    for _ in range(rnd.randint(1, 4)):
+                        parts.append(('Area %s' % 'ABCD'[group], 'Complete an activity in area %s' % 'ABCD'[group]))
+            else:
+                for number in range(rnd.randint(1, 12)):
+                    parts.append(('Requirement %d' % (number + 1), 'Requirement %d for %s' % (number + 1, name)))
+            badges.append({
+                'index': index,
+                'identifier': '%s_%s' % (badge_id, version),
+                'badge_id': badge_id,
+                'version': version,
+                'type': badge_type,
+                'name': name,
+                'parts': [{'field': '_%d' % (field + number), 'name': part[0], 'tooltip': part[1]}
+                          for number, part in enumerate(parts)],
+            })
+            field += len(parts)
+        return badges
+
+    def term_members(self, section, term):
+        ''' The members (leaders first) who are in a term. '''
+        first = self.leader_count + term['index'] * self.turnover
+        return section['members'][:self.leader_count] + section['members'][first:first + self.member_count]
+
+    def _plan(self, section, badge):
+        ''' When each member of a section completes each part of a badge, as term indexes (None is never). '''
+        key = (section['index'], badge['index'])
+        try:
+            return self._plans[key]
+        except KeyError:
+            pass
+
+        plan = {}
+        rnd = self._random('progress', section['index'], badge['index'])
+        for member in section['members']:
+            if member['patrol'] == 'Leaders' or rnd.random() > member['keenness'] * 0.5:
+                continue
+            started = member['join'] + rnd.randint(0, 3)
+            parts = [started + rnd.randint(0, 2) if rnd.random() < 0.9 else None for _ in badge['parts']]
+            finished = None
+            if len(parts) > 0 and not None in parts:
+                finished = max(parts)
+            plan[member['id']] = (parts, finished)
+        with self._lock:
+            self._plans[key] = plan
+        return plan
+
+    def response(self, url, data=None):
+        ''' Builds the response for a request, as the parsed JSON OSM would return. '''
+        params = dict(re.findall(r'(\w+)=([^&]*)', url.split('?', 1)[-1]))
+        if not data is None:
+            params.update(data)
+        action = params.get('action')
+        if action == 'authorise':
+            return {'userid': 'fixture', 'secret': 'fixture'}
+        if action == 'getUserRoles':
+            return self._user_roles()
+        if action == 'getTerms':
+            return self._terms()
+        if action == 'addMeeting':
+            return {'lastmeetingadded': '1'}
+        if action in ('editEveningParts', 'deleteMeeting'):
+            return {}
+
+        section = self._find(self.sections, params.get('section_id') or params.get('sectionid'))
+        if action == 'updateSingleRecord':
+            badge = self._find(self.badges, '%s_%s' % (params['badge_id'], params['badge_version']), 'identifier')
+            return self._update_record(section, badge, str(params['scoutid']), params['field'], params['value'])
+        term = self._find(section['terms'], params.get('term_id') or params.get('termid'))
+        if action == 'getBadgeStructureByType':
+            return self._badge_structure(int(params['type_id']))
+        if action == 'getBadgeRecords':
+            badge = self._find(self.badges, '%s_%s' % (params['badge_id'], params['badge_version']), 'identifier')
+            return self._badge_records(section, term, badge)
+        if action == 'getMembers':
+            return self._members(section, term)
+        if action == 'loadBadgesByMember':
+            return self._badges_by_member(section, term)
+        if action == 'getProgrammeSummary':
+            return self._programme(section, term)
+        if action == 'get' and '/attendance/' in url:
+            return self._attendance(section, term)
+        raise Error('No fixture for %s' % (url, ))
+
+    def _find(self, items, value, field='id'):
+        for item in items:
+            if item[field] == str(value):
+                return item
+        raise Error('Unknown %s: %s' % (field, value))
+
+    def _user_roles(self):
+        return [{'sectionname': section['name'], 'section': section['type'],
+                 'groupname': 'Fixture Group', 'sectionid': section['id']} for section in self.sections]
+
+    def _terms(self):
+        return dict((section['id'], [{'name': term['name'], 'termid': term['id'],
+                                      'startdate': term['start'].strftime('%Y-%m-%d'),
+                                      'enddate': term['end'].strftime('%Y-%m-%d')}
+                                     for term in section['terms']])
+                    for section in self.sections)
+
+    def _badge_structure(self, badge_type):
+        details = {}
+        structure = {}
+        for badge in self.badges:
+            if badge['type'] != badge_type:
+                continue
+            details[badge['identifier']] = {
+                'badge_identifier': badge['identifier'],
+                'badge_id': badge['badge_id'],
+                'badge_version': badge['version'],
+                'name': badge['name'],
+                'group_name': BADGE_TYPES[badge_type],
+                'picture': '/badges/%s.png' % (badge['badge_id'], ),
+            }
+            structure[badge['identifier']] = [{'rows': []}, {'rows': badge['parts']}]
+        return {'details': details, 'structure': structure}
+
+    def _badge_records(self, section, term, badge):
+        plan = self._plan(section, badge)
+        items = []
+        for member in self.term_members(section, term):
+            item = {
+                'scoutid': member['id'],
+                'firstname': member['first_name'],
+                'lastname': member['last_name'],
+                'completed': '0',
+            }
+            try:
+                parts, finished = plan[member['id']]
+            except KeyError:
+                parts, finished = [], None
+            for part, done in zip(badge['parts'], parts):
+                if not done is None and done <= term['index']:
+                    item[part['field']] = section['terms'][done]['start'].strftime('%d/%m/%Y')
+            if not finished is None and finished <= term['index']:
+                item['completed'] = '1'
+            with self._lock:
+                item.update(self._updates.get((section['id'], badge['identifier'], member['id']), {}))
+            items.append(item)
+        return {'items': items}
+
+    def _update_record(self, section, badge, member_id, field, value):
+        if not field in [part['field'] for part in badge['parts']]:
+            return {'error': 'Unknown field %s' % (field, )}
+        with self._lock:
+            self._updates.setdefault((section['id'], badge['identifier'], member_id), {})[field] = value
+        return {'status': True}
+
+    def _members(self, section, term):
+        structure = [{'identifier': name, 'group_id': group_id,
+                      'columns': [{'varname': column, 'column_id': column_id}
+                                  for column, column_id in CUSTOM_COLUMNS]}
+                     for name, group_id in CUSTOM_GROUPS]
+        members = {}
+        for member in self.term_members(section, term):
+            rnd = self._random('contacts', member['id'])
+            custom_data = {}
+            for name, group_id in CUSTOM_GROUPS:
+                if group_id > 2 and rnd.random() < 0.2:
+                    custom_data[str(group_id)] = None
+                    continue
+                custom_data[str(group_id)] = {
+                    '2': rnd.choice(FIRST_NAMES),
+                    '3': member['last_name'],
+                    '4': '021 %03d %04d' % (rnd.randint(0, 999), rnd.randint(0, 9999)) if rnd.random() < 0.9 else None,
+                    '5': '09 %03d %04d' % (rnd.randint(0, 999), rnd.randint(0, 9999)),
+                    '12': '%s@example.com' % (member['last_name'].lower(), ),
+                }
+            members[member['id']] = {
+                'member_id': member['id'],
+                'first_name': member['first_name'],
+                'last_name': member['last_name'],
+                'active': True,
+                'date_of_birth': member['dob'],
+                'patrol': member['patrol'],
+                'patrol_role_level_label': member['role'],
+                'custom_data': custom_data,
+            }
+        return {'data': members, 'meta': {'structure': structure}}
+
+    def _badges_by_member(self, section, term):
+        people = []
+        plans = [(badge, self._plan(section, badge)) for badge in self.badges]
+        for member in self.term_members(section, term):
+            links = []
+            for badge, plan in plans:
+                try:
+                    finished = plan[member['id']][1]
+                except KeyError:
+                    continue
+                if finished is None or finished > term['index']:
+                    continue
+                links.append({
+                    'badge_id': badge['badge_id'],
+                    'badge': '%s (%s)' % (badge['name'], BADGE_TYPES[badge['type']]),
+                    'picture': '/badges/%s.png' % (badge['badge_id'], ),
+                    'completed': '1',
+                    'awarded': '1' if finished < term['index'] else '0',
+                })
+            people.append({
+                'scout_id': member['id'],
+                'firstname': member['first_name'],
+                'lastname': member['last_name'],
+                'active': True,
+                'dob': member['dob'],
+                'patrol': member['patrol'],
+                'patrol_role_level_label': member['role'],
+                'badges': links,
+            })
+        return {'data': people}
+
+    def _meeting_dates(self, term):
+        return [term['start'] + timedelta(days=7 * week) for week in range(self.meeting_count)]
+
+    def _programme(self, section, term):
+        items = []
+        for week, day in enumerate(self._meeting_dates(term)):
+            items.append({
+                'eveningid': str(3000000 + int(term['id']) * 100 + week),
+                'title': '%s night %d' % (section['name'], week + 1),
+                'meetingdate': day.strftime('%Y-%m-%d'),
+                'starttime': '18:30:00',
+                'endtime': '20:00:00',
+                'prenotes': '',
+                'postnotes': '',
+                'notesforparents': 'Bring a torch' if week % 3 == 0 else '',
+                'leaders': 'Leaders',
+            })
+        return {'items': items}
+
+    def _attendance(self, section, term):
+        items = []
+        dates = [day.strftime('%Y-%m-%d') for day in self._meeting_dates(term)]
+        for member in self.term_members(section, term):
+            rnd = self._random('attendance', term['id'], member['id'])
+            item = {
+                'scoutid': member['id'],
+                'firstname': member['first_name'],
+                'lastname': member['last_name'],
+                'active': True,
+                'dob': member['dob'],
+                'patrol': member['patrol'],
+                'patrol_role_level_label': member['role'],
+            }
+            for day in dates:
+                item[day] = 'Yes' if rnd.random() < member['attendance'] else 'No'
+            items.append(item)
+        return {'items': items}
+
+
+class FixtureConnection(object):
+    ''' A stand-in for osm.Connection that answers from a dataset, optionally after a delay. '''
+
+    def __init__(self, dataset, latency=0):
+        self.dataset = dataset
+        self.latency = latency
+        self.journal = None
+        self.requests = 0
+        self.uploads = []
+        self.in_flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        pass
+
+    def fetch(self, url, data=None):
+        key = url
+        if not data is None:
+            key += ' ' + json.dumps(data, sort_keys=True)
+        if not self.journal is None and key in self.journal:
+            return self.journal.get(key)
+        return self.in_flight.do(key, lambda: self._fetch(key, url, data))
+
+    def _fetch(self, key, url, data):
+        resp = self._send(url, data)
+        if not self.journal is None:
+            self.journal.record(key, resp)
+        return resp
+
+    def download(self, url):
+        return self._send(url, None)
+
+    def upload(self, url, data):
+        with self._lock:
+            self.uploads.append((url, data))
+        return self._send(url, data)
+
+    def download_binary(self, url, filename):
+        with open(filename, 'wb') as f:
+            f.write(PNG)
+
+    def _send(self, url, data):
+        with self._lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.dataset.response(url, data)
+
+
+def patch(module, dataset, latency=0):
+    ''' Makes a report generator module use a dataset instead of OSM. '''
+    module.Connection = lambda settings_path: FixtureConnection(dataset, latency)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:5]]
+    members, badges, terms, sections = (sizes + [30, 60, 4, 1][len(sizes):])[:4]
+    print('Generating %d section(s) with %d terms, %d members and %d badges...' %
+          (sections, terms, members, badges))
+    conn = FixtureConnection(Dataset(sections=sections, terms=terms, members=members, badges=badges))
+    start = time.time()
+    mgr = Manager()
+    mgr.load(conn)
+    print('-> Manager: %.2fs' % (time.time() - start, ))
+    for section in mgr.sections:
+        for term in section.terms:
+            timings = []
+            for name, load in [('members', lambda: term.load_members(conn, True)),
+                               ('badges', lambda: term.load_badges(conn)),
+                               ('progress', lambda: term.load_progress(conn)),
+                               ('badge report', lambda: term.load_badges_by_person(conn)),
+                               ('programme', lambda: term.load_programme(conn, True))]:
+                started = time.time()
+                load()
+                timings.append('%s %.2fs' % (name, time.time() - started))
+            print('-> %s %s: %s' % (section.name, term.name, ', '.join(timings)))
+    print('Done: %d requests in %.2fs' % (conn.requests, time.time() - start))
@@ -0,0 +1,102 @@
+''' Overlapping stages connected by bounded queues. '''
+
+import collections
+import queue
+import threading
+
+# The number of finished items each stage can get ahead of the next one.
+PIPELINE_SIZE = 2
+
+# The number of items whose work is started ahead of the item being used.
+PREFETCH_SIZE = 4
+
+_ITEM, _DONE, _ERROR = range(3)
+
+
+class Pipeline(object):
+    ''' Passes items through a series of stages, each running in its own thread.
+
+        Stages hand their results to the next stage through bounded queues, so a
+        slow stage holds back the earlier ones rather than letting work pile up.
+        Items come out in the order they went in. '''
+
+    def __init__(self, stages, size=PIPELINE_SIZE):
+        self._stages = stages
+        self._size = size
+
+    def run(self, items):
+        ''' Yields the result of each item after every stage; errors in a stage are raised here. '''
+        cancelled = threading.Event()
+        source = iter(items)
+        inbox = None
+        for stage in self._stages:
+            outbox = queue.Queue(self._size)
+            thread = threading.Thread(target=_run_stage, args=(stage, source, inbox, outbox, cancelled))
+            thread.daemon = True
+            thread.start()
+            inbox = outbox
+
+        try:
+            while True:
+                kind, value = inbox.get()
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            cancelled.set()
+
+
+def prefetch(items, start, size=PREFETCH_SIZE):
+    ''' Yields (item, start(item)) in order, having already called start on up to size of the
+        following items. start should only begin the work (e.g. submit it to an executor), so
+        the work for the next items runs while this one is used, but never more than size ahead. '''
+    started = collections.deque()
+    for item in items:
+        started.append((item, start(item)))
+        if len(started) > size:
+            yield started.popleft()
+    while len(started) > 0:
+        yield started.popleft()
+
+def _run_stage(stage, source, inbox, outbox, cancelled):
+    try:
+        while True:
+            if inbox is None:
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+            else:
+                message = _get(inbox, cancelled)
+                if message is None:
+                    return
+                if message[0] != _ITEM:
+                    _put(outbox, message, cancelled)
+                    return
+                item = message[1]
+            if not _put(outbox, (_ITEM, stage(item)), cancelled):
+                return
+        _put(outbox, (_DONE, None), cancelled)
+    except Exception as e:
+        _put(outbox, (_ERROR, e), cancelled)
+
+def _get(inbox, cancelled):
+    ''' Waits for the next message, giving up (returning None) if the pipeline is cancelled. '''
+    while not cancelled.is_set():
+        try:
+            return inbox.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+def _put(outbox, message, cancelled):
+    ''' Waits for room for a message, giving up (returning False) if the pipeline is cancelled. '''
+    while not cancelled.is_set():
+        try:
+            outbox.put(message, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
@@ -0,0 +1,165 @@
+''' An append-only history of badge progress, stored as deltas between syncs. '''
+
+import json
+
+from datetime import datetime, timedelta
+
+# A full copy of the state is written after this many deltas.
+KEYFRAME_INTERVAL = 20
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class ProgressHistory(object):
+    ''' The history of badge progress for a section.
+
+        Each line in the file is "<time>\\t<K|D>\\t<json>": K lines hold the
+        full state (a keyframe) and D lines hold the changes since the
+        previous line. The state maps "badge_id member_id" to
+        [completed, [part ids]]. '''
+
+    def __init__(self, path):
+        self._path = path
+        # The size of the file up to the end of its last complete record, once it has been read.
+        self._end = None
+
+    def snapshot(self, badges, when=None):
+        ''' Records the progress of the given (loaded) badges.
+            Returns the number of changed records. '''
+        if when is None:
+            when = datetime.now()
+        current = {}
+        badge_ids = set()
+        for badge in badges:
+            badge_ids.add(badge.badge_id)
+            for item in badge.progress:
+                current[_key(badge.badge_id, item.member_id)] = [
+                    1 if item.completed else 0, sorted(item.parts.keys())]
+
+        records = self._read()
+        previous = _replay(records[_last_keyframe(records):])
+        changed = dict((key, value) for key, value in current.items()
+                       if previous.get(key) != value)
+        removed = [key for key in previous
+                   if _badge_of(key) in badge_ids and not key in current]
+        if len(changed) == 0 and len(removed) == 0:
+            return 0
+
+        since_keyframe = 0
+        for _, kind, _ in reversed(records):
+            if kind == 'K':
+                break
+            since_keyframe += 1
+
+        if len(records) == 0 or since_keyframe >= KEYFRAME_INTERVAL:
+            state = dict(previous)
+            state.update(changed)
+            for key in removed:
+                del state[key]
+            self._append(when, 'K', state)
+        else:
+            self._append(when, 'D', {'set': changed, 'del': removed})
+        return len(changed) + len(removed)
+
+    def state_at(self, when):
+        ''' Rebuilds the state as it was at a time, starting from the closest earlier keyframe. '''
+        records = [record for record in self._read() if record[0] <= when]
+        return _replay(records[_last_keyframe(records):])
+
+    def parts_completed_per_week(self, badge_ids=None):
+        ''' Counts the parts newly completed in each week (starting Monday).
+            The first snapshot is the baseline, so it is not counted.
+            Returns a sorted list of (week start date, count). '''
+        weeks = {}
+        state = None
+        for when, kind, data in self._read():
+            data = json.loads(data)
+            if state is None:
+                state = data
+                continue
+
+            if kind == 'K':
+                changed, removed = data, [key for key in state if not key in data]
+            else:
+                changed, removed = data['set'], data['del']
+            added = 0
+            for key, value in changed.items():
+                if badge_ids is None or _badge_of(key) in badge_ids:
+                    try:
+                        old_parts = set(state[key][1])
+                    except KeyError:
+                        old_parts = set()
+                    added += len(set(value[1]) - old_parts)
+                state[key] = value
+            for key in removed:
+                state.pop(key, None)
+
+            if added > 0:
+                week = when.date() - timedelta(days=when.weekday())
+                weeks[week] = weeks.get(week, 0) + added
+        return sorted(weeks.items())
+
+    def _read(self):
+        ''' Reads the (time, kind, json text) records, stopping at the first line a crash left unfinished.
+            The json is only checked for shape here; callers decode the records they need. '''
+        self._end = 0
+        try:
+            with open(self._path, 'rb') as f:
+                lines = f.readlines()
+        except IOError:
+            return []
+
+        records = []
+        for line in lines:
+            try:
+                parts = line.decode('utf-8').rstrip('\n').split('\t', 2)
+                if not line.endswith(b'\n') or not _is_complete(parts):
+                    raise ValueError('Unfinished line')
+                records.append((datetime.strptime(parts[0], TIME_FORMAT), parts[1], parts[2]))
+            except ValueError:
+                break
+            self._end += len(line)
+        return records
+
+    def _append(self, when, kind, data):
+        if self._end is None:
+            self._read()
+        line = ('%s\t%s\t%s\n' % (when.strftime(TIME_FORMAT), kind,
+                                  json.dumps(data, separators=(',', ':'), sort_keys=True))).encode('utf-8')
+        with open(self._path, 'ab') as f:
+            # Drop any unfinished line so the new record starts on a line of its own.
+            f.truncate(self._end)
+            f.write(line)
+        self._end += len(line)
+
+
+def _is_complete(parts):
+    ''' Checks the shape of a record without decoding it. The json never holds a raw tab, so a
+        record written onto the end of an unfinished one is caught as well. '''
+    return (len(parts) == 3 and parts[1] in ('K', 'D') and parts[2].startswith('{')
+            and parts[2].endswith('}') and not '\t' in parts[2])
+
+def _last_keyframe(records):
+    for index in range(len(records) - 1, -1, -1):
+        if records[index][1] == 'K':
+            return index
+    return 0
+
+def _replay(records):
+    ''' Applies the records in order to rebuild the state. '''
+    state = {}
+    for _, kind, data in records:
+        data = json.loads(data)
+        if kind == 'K':
+            state = dict(data)
+        else:
+            state.update(data['set'])
+            for key in data['del']:
+                state.pop(key, None)
+    return state
+
+def _key(badge_id, member_id):
+    return '%s %s' % (badge_id, member_id)
+
+def _badge_of(key):
+    return key.split(' ', 1)[0]
@@ -0,0 +1,145 @@
+''' Snapshots of term data that can be compared between runs. '''
+
+import json
+
+from osm import write_json
+
+
+class TermState(object):
+    ''' The comparable parts of a term's data, held as sets of string keys. '''
+
+    def __init__(self, data=None):
+        if data is None:
+            data = {}
+        self.members = dict(data.get('members', {}))
+        self.parts = set(data.get('parts', []))
+        self.completed = set(data.get('completed', []))
+        self.links = set(data.get('links', []))
+        self.awarded = set(data.get('awarded', []))
+        self.attendance = set(data.get('attendance', []))
+
+    @staticmethod
+    def from_term(term, report=None):
+        ''' Captures the loaded members, badge progress, badge links and attendance of a term. '''
+        state = TermState()
+        for member in term.members:
+            state.members[str(member.member_id)] = '%s %s' % (member.first_name, member.last_name)
+        for badge in term.badges:
+            for item in badge.progress:
+                member_id = str(item.member_id)
+                state.members.setdefault(member_id, '%s %s' % (item.firstname, item.lastname))
+                for part_id in item.parts:
+                    state.parts.add(_key(member_id, badge.badge_id, part_id))
+                if item.completed:
+                    state.completed.add(_key(member_id, badge.badge_id))
+        for person in report or []:
+            member_id = str(person.member_id)
+            state.members.setdefault(member_id, '%s %s' % (person.first_name, person.last_name))
+            for link in person.badges:
+                if link.completed:
+                    state.links.add(_key(member_id, link.badge_id, link.name))
+                if link.awarded:
+                    state.awarded.add(_key(member_id, link.badge_id, link.name))
+        for meeting in term.programme:
+            date = meeting.date.strftime('%Y-%m-%d')
+            for member in meeting.members:
+                state.attendance.add(_key(str(member.member_id), date))
+        return state
+
+    def to_dict(self):
+        return {
+            'members': self.members,
+            'parts': sorted(self.parts),
+            'completed': sorted(self.completed),
+            'links': sorted(self.links),
+            'awarded': sorted(self.awarded),
+            'attendance': sorted(self.attendance),
+        }
+
+
+class TermDiff(object):
+    ''' The changes between two term states. '''
+
+    def __init__(self, old, new):
+        self.members = new.members
+        self.new_members = sorted(set(new.members) - set(old.members))
+        self.left_members = sorted(set(old.members) - set(new.members))
+        self.new_parts = sorted(new.parts - old.parts)
+        self.new_completed = sorted(new.completed - old.completed)
+        self.new_links = sorted(new.links - old.links)
+        self.new_awarded = sorted(new.awarded - old.awarded)
+        self.attended = sorted(new.attendance - old.attendance)
+        self.unattended = sorted(old.attendance - new.attendance)
+
+    def has_changes(self):
+        return any([self.new_members, self.left_members, self.new_parts, self.new_completed,
+                    self.new_links, self.new_awarded, self.attended, self.unattended])
+
+    def progress_members(self):
+        ''' The ids of members whose badge progress has changed. '''
+        return set(_member_of(key) for key in self.new_parts + self.new_completed) | set(self.new_members)
+
+    def progress_badges(self):
+        ''' The ids of badges whose progress has changed. '''
+        return set(key.split(' ')[1] for key in self.new_parts + self.new_completed)
+
+    def badge_members(self):
+        ''' The ids of members who have newly completed or been awarded badges. '''
+        return set(_member_of(key) for key in self.new_links + self.new_awarded) | set(self.new_members)
+
+
+class StateStore(object):
+    ''' Keeps the term state from the previous and current refreshes (see generate_changes.py).
+        States saved for another term (e.g. after the current term rolls over) are ignored. '''
+
+    def __init__(self, path, term_id):
+        self._path = path
+        self._term_id = str(term_id)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = {}
+        self._other_term = data.get('term', self._term_id) != self._term_id
+        if self._other_term:
+            data = {}
+        # Whether a refresh of this term has been saved, so there is something to compare with.
+        self.saved = 'current' in data
+        self.previous = TermState(data.get('previous'))
+        self.current = TermState(data.get('current'))
+
+    def rotate(self, state):
+        ''' Makes the given state current, keeping the old current state as the previous one.
+            The first state of a new term is the baseline, so it has no changes. '''
+        if self._other_term:
+            self.current = state
+            self._other_term = False
+        self.previous, self.current = self.current, state
+        write_json(self._path, {
+            'term': self._term_id,
+            'previous': self.previous.to_dict(),
+            'current': self.current.to_dict(),
+        })
+        self.saved = True
+        return self.diff()
+
+    def diff(self):
+        ''' The changes between the previous and current refreshes. '''
+        return TermDiff(self.previous, self.current)
+
+
+def open_state(section_name, term):
+    ''' Opens the state saved by generate_changes.py for a "changed" report, or tells the
+        user to run it first if it has not saved a refresh of this term. '''
+    path = section_name + '-state.json'
+    store = StateStore(path, term.term_id)
+    if not store.saved:
+        print('-> No refresh of %s has been saved in %s: run generate_changes.py first' % (str(term), path))
+        return None
+    return store
+
+def _key(*parts):
+    return ' '.join(str(part) for part in parts)
+
+def _member_of(key):
+    return key.split(' ', 1)[0]